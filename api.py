@@ -1,7 +1,31 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
+from functools import wraps
+from config import (API_TOKEN, CATALOG_CHECK_INTERVAL, CATALOG_STREAM_HISTORY, CATALOG_STREAM_HEARTBEAT,
+                    CATALOG_STREAM_MAX_SUBSCRIBERS, ORDER_BATCH_MAX, PRODUCTS_MAX_AGE, PRODUCTS_STALE_WHILE_REVALIDATE,
+                    ORDER_RATE_PER_CLIENT, ORDER_BURST_PER_CLIENT, ORDER_RATE_GLOBAL, ORDER_BURST_GLOBAL,
+                    ORDER_MAX_IN_FLIGHT, ORDER_IN_FLIGHT_WAIT, RATE_LIMIT_MAX_CLIENTS, TRUSTED_PROXY_HOPS,
+                    WEB_WORKERS)
 from database import db
+import catalog_io
+import exports
+from catalog_stream import CatalogChangeFeed
+import metrics
+import ratelimit
+import schemas
+import base64
+import gzip
+import hashlib
+import hmac
 import os
+import threading
+import time
+import zlib
+
+try:
+    import brotli  # optional: pip install brotli to also serve Content-Encoding: br
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 
@@ -10,10 +34,45 @@ CORS(app, resources={
     r"/api/*": {
         "origins": "*",  # Или укажи: ["https://твой-сайт.vercel.app"]
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "allow_headers": ["Content-Type", "Authorization"]
     }
 })
 
+# ============ METRICS ============
+
+HTTP_REQUEST_SECONDS = metrics.histogram('spirit420_http_request_seconds', 'API request latency in seconds',
+                                         ('method', 'route', 'status'))
+HTTP_REQUESTS_IN_FLIGHT = metrics.gauge('spirit420_http_requests_in_flight', 'API requests being handled')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUESTS_IN_FLIGHT.dec()
+        # Label by route pattern, not path, so /api/orders/<id>-style URLs don't explode cardinality
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method, route, response.status_code)
+    return response
+
+def require_api_token(view):
+    """Allow the request only with a valid 'Authorization: Bearer <API_TOKEN>' header"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        auth = request.headers.get('Authorization', '')
+        token = auth[len('Bearer '):] if auth.startswith('Bearer ') else ''
+        if not API_TOKEN or not hmac.compare_digest(token, API_TOKEN):
+            return jsonify({
+                'success': False,
+                'error': 'Unauthorized'
+            }), 401
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/')
 def home():
     """Home endpoint"""
@@ -22,46 +81,377 @@ def home():
         'message': 'spirit420 API is running',
         'endpoints': {
             'products': '/api/products',
-            'orders': '/api/orders'
+            'products_stream': '/api/products/stream',
+            'orders': '/api/orders',
+            'orders_batch': '/api/orders/batch',
+            'metrics': '/metrics'
         }
     })
 
+PRODUCTS_CACHE_CONTROL = (f'public, max-age={PRODUCTS_MAX_AGE}, '
+                          f'stale-while-revalidate={PRODUCTS_STALE_WHILE_REVALIDATE}')
+
+def product_to_dict(product):
+    """Format a full product row for the website"""
+    product_id, name, category, product_type, thc, price, description, special, is_active = product
+    
+    return {
+        'id': product_id,
+        'name': name,
+        'category': category,
+        'type': product_type,
+        'thc': thc,
+        'price': price,
+        'description': description,
+        'special': special,
+        'desc': description  # для совместимости с текущим форматом сайта
+    }
+
+class CatalogBodies:
+    """Ready-to-send /api/products bodies for one catalog version, per Content-Encoding"""
+    
+    def __init__(self, catalog):
+        self.version = catalog.version
+        
+        products_list = [product_to_dict(product) for product in catalog.active]
+        identity = app.json.dumps({
+            'success': True,
+            'products': products_list,
+            'count': len(products_list)
+        }).encode('utf-8')
+        
+        # Preferred first: best_match picks the earliest among equally acceptable encodings
+        self.bodies = {}
+        if brotli is not None:
+            self.bodies['br'] = brotli.compress(identity)
+        self.bodies['gzip'] = gzip.compress(identity, compresslevel=9, mtime=0)
+        self.bodies['deflate'] = zlib.compress(identity, 9)
+        self.bodies['identity'] = identity
+
+_catalog_bodies = None
+_catalog_bodies_lock = threading.Lock()
+
+def get_catalog_bodies(catalog):
+    """Get the encoded bodies for this catalog version, building them once per version"""
+    global _catalog_bodies
+    
+    bodies = _catalog_bodies
+    if bodies is None or bodies.version != catalog.version:
+        with _catalog_bodies_lock:
+            bodies = _catalog_bodies
+            if bodies is None or bodies.version != catalog.version:
+                bodies = _catalog_bodies = CatalogBodies(catalog)
+    return bodies
+
+PRODUCT_FIELDS = ('id', 'name', 'category', 'type', 'thc', 'price', 'description', 'special', 'desc')
+
+# sort=<key> ascending, sort=-<key> descending; products without a value go last
+PRODUCT_SORT_KEYS = {
+    'newest': None,  # snapshot order
+    'price': lambda product: product[5],
+    'thc': lambda product: product[4],
+    'name': lambda product: (product[1] or '').lower()
+}
+
+PRODUCTS_PAGE_MAX = 200
+
+def _int_arg(name):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+def query_products(catalog):
+    """Apply the /api/products query parameters to a catalog snapshot"""
+    # Category/type narrowing is a dictionary lookup in the snapshot indexes
+    products = catalog.select(request.args.get('category'), request.args.get('type'))
+    
+    min_thc, max_thc = _int_arg('min_thc'), _int_arg('max_thc')
+    min_price, max_price = _int_arg('min_price'), _int_arg('max_price')
+    if min_thc is not None or max_thc is not None:
+        products = [p for p in products if p[4] is not None
+                    and (min_thc is None or p[4] >= min_thc) and (max_thc is None or p[4] <= max_thc)]
+    if min_price is not None or max_price is not None:
+        products = [p for p in products
+                    if (min_price is None or p[5] >= min_price) and (max_price is None or p[5] <= max_price)]
+    
+    sort = request.args.get('sort', 'newest')
+    descending = sort.startswith('-')
+    sort_name = sort.lstrip('-')
+    if sort_name not in PRODUCT_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(PRODUCT_SORT_KEYS)} (prefix - for descending)")
+    key = PRODUCT_SORT_KEYS[sort_name]
+    if key is None:
+        products = list(reversed(products)) if descending else list(products)
+    else:
+        present = [p for p in products if key(p) is not None]
+        missing = [p for p in products if key(p) is None]
+        products = sorted(present, key=key, reverse=descending) + missing
+    
+    fields = request.args.get('fields')
+    if fields:
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    
+    # Pagination: the cursor is an opaque offset into this (filtered, sorted) result
+    limit = _int_arg('limit')
+    offset = 0
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            offset = max(int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))), 0)
+        except ValueError:
+            raise ValueError('Invalid cursor')
+    total = len(products)
+    if limit is not None:
+        limit = min(max(limit, 1), PRODUCTS_PAGE_MAX)
+        products = products[offset:offset + limit]
+    elif offset:
+        products = products[offset:]
+    
+    next_offset = offset + len(products)
+    next_cursor = None
+    if limit is not None and next_offset < total:
+        next_cursor = base64.urlsafe_b64encode(str(next_offset).encode()).decode().rstrip('=')
+    
+    products_list = [product_to_dict(product) for product in products]
+    if fields:
+        products_list = [{field: product[field] for field in fields} for product in products_list]
+    
+    return products_list, total, next_cursor
+
 @app.route('/api/products', methods=['GET'])
 def get_products():
-    """Get all active products"""
+    """Get active products (optionally filtered, sorted, paginated - see query_products)"""
     try:
-        products = db.get_all_products(include_hidden=False)
+        if request.args:
+            return get_products_query()
         
-        # Format products for website
-        products_list = []
-        for product in products:
-            product_id, name, category, product_type, thc, price, description, special, is_active = product
-            
-            products_list.append({
-                'id': product_id,
-                'name': name,
-                'category': category,
-                'type': product_type,
-                'thc': thc,
-                'price': price,
-                'description': description,
-                'special': special,
-                'desc': description  # для совместимости с текущим форматом сайта
-            })
+        # The catalog version changes on every products write, so it makes a strong ETag.
+        # Revalidation is answered from the in-memory snapshot without reading products.
+        catalog = db.catalog()
+        bodies = get_catalog_bodies(catalog)
         
+        encoding = request.accept_encodings.best_match(list(bodies.bodies), default='identity')
+        etag = f'catalog-{catalog.version}' if encoding == 'identity' else f'catalog-{catalog.version}-{encoding}'
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': PRODUCTS_CACHE_CONTROL,
+            'Vary': 'Accept-Encoding'
+        }
+        
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+        
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        
+        return Response(bodies.bodies[encoding], mimetype='application/json', headers=headers)
+    
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'products': products_list,
-            'count': len(products_list)
-        })
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def get_products_query():
+    """/api/products with query parameters"""
+    catalog = db.catalog()
+    
+    # Same version-based ETag, qualified by the normalized query string
+    query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    etag = f'catalog-{catalog.version}-{hashlib.sha1(query.encode()).hexdigest()[:12]}'
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': PRODUCTS_CACHE_CONTROL}
     
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    
+    try:
+        products_list, total, next_cursor = query_products(catalog)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    response = jsonify({
+        'success': True,
+        'products': products_list,
+        'count': len(products_list),
+        'total': total,
+        'nextCursor': next_cursor
+    })
+    response.headers.update(headers)
+    return response
+
+catalog_feed = CatalogChangeFeed(db, product_to_dict, history=CATALOG_STREAM_HISTORY,
+                                 poll_interval=CATALOG_CHECK_INTERVAL)
+
+@app.route('/api/products/stream', methods=['GET'])
+def stream_products():
+    """Server-Sent Events: added/updated/removed/visibility diffs, each with id = catalog version
+
+    Fetch /api/products first, then subscribe with ?since=<version from its ETag>;
+    on reconnect the browser resumes from Last-Event-ID. A reset event means
+    the diffs are no longer available and the list must be fetched again.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    last_version = None
+    if last_event_id is not None:
+        try:
+            last_version = int(last_event_id)
+        except ValueError:
+            last_version = -1  # unknown position: the stream starts with a reset
+
+    if catalog_feed.subscribers >= CATALOG_STREAM_MAX_SUBSCRIBERS:
+        response = jsonify({
+            'success': False,
+            'error': 'Too many subscribers, retry later'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    return Response(
+        catalog_feed.stream(last_version, heartbeat=CATALOG_STREAM_HEARTBEAT),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # keep nginx-style proxies from buffering the stream
+        }
+    )
+
+@app.route('/api/products/export', methods=['GET'])
+@require_api_token
+def export_products():
+    """Export the whole catalog as CSV or JSONL"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in catalog_io.FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f'Unsupported format: {fmt}'
+        }), 400
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        catalog_io.export_products(db, fmt),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=catalog.{fmt}'}
+    )
+
+@app.route('/api/products/import', methods=['POST'])
+@require_api_token
+def import_products():
+    """Bulk upsert products from a CSV or JSONL upload (multipart 'file' or raw body)"""
+    try:
+        upload = request.files.get('file')
+        if upload:
+            data = upload.read()
+            default_format = catalog_io.detect_format(upload.filename)
+        else:
+            data = request.get_data()
+            default_format = 'jsonl' if 'ndjson' in (request.content_type or '') else 'csv'
+
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return jsonify({
+                'success': False,
+                'error': 'File must be UTF-8 encoded'
+            }), 400
+
+        fmt = request.args.get('format', default_format)
+        if fmt not in catalog_io.FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f'Unsupported format: {fmt}'
+            }), 400
+
+        report = catalog_io.import_products(db, text, fmt)
+
+        return jsonify({
+            'success': not report.errors,
+            **report.to_dict()
+        })
+
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+# ============ ADMISSION CONTROL ============
+
+# Built at import, which serve.py does before forking, so all workers share the token
+# buckets. Write slots are per process, so ORDER_MAX_IN_FLIGHT is split between workers.
+order_admission = ratelimit.AdmissionController(
+    ORDER_RATE_PER_CLIENT, ORDER_BURST_PER_CLIENT,
+    ORDER_RATE_GLOBAL, ORDER_BURST_GLOBAL,
+    max(1, ORDER_MAX_IN_FLIGHT // max(WEB_WORKERS, 1)) if ORDER_MAX_IN_FLIGHT > 0 else 0,
+    ORDER_IN_FLIGHT_WAIT,
+    max_clients=RATE_LIMIT_MAX_CLIENTS
+)
+
+ORDER_REJECTIONS = metrics.counter('spirit420_order_rejections_total', 'Order writes rejected with 429', ('reason',))
+
+_ignored_forwarded_for = threading.Event()
+
+def client_ip():
+    """Client address, taken from X-Forwarded-For when behind TRUSTED_PROXY_HOPS proxies"""
+    if TRUSTED_PROXY_HOPS:
+        forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    elif 'X-Forwarded-For' in request.headers and not _ignored_forwarded_for.is_set():
+        # Behind a proxy every client shares the proxy's address, and so its rate limit
+        _ignored_forwarded_for.set()
+        app.logger.warning("X-Forwarded-For is present but ignored: set TRUSTED_PROXY_HOPS to the "
+                           "number of proxies in front of the API, or all clients share one rate limit")
+    return request.remote_addr or 'unknown'
+
+def too_many_requests(reason, retry_after):
+    ORDER_REJECTIONS.inc(reason)
+    response = jsonify({
+        'success': False,
+        'error': 'Too many requests, retry later'
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = ratelimit.retry_after_header(retry_after)
+    return response
+
+def admit_order_writes(view):
+    """Rate-limit the view and bound how many of its writes run at once (429 otherwise)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Checked before the body is parsed so rejections stay cheap
+        reason, retry_after = order_admission.check_rate(client_ip())
+        if reason:
+            return too_many_requests(reason, retry_after)
+
+        if not order_admission.acquire_write_slot():
+            return too_many_requests('in_flight', 1)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            order_admission.release_write_slot()
+    return wrapper
+
+def invalid_order(error, order_id=None):
+    """422 response listing every schema problem"""
+    return jsonify({
+        'success': False,
+        'orderId': order_id,
+        'error': 'Invalid order',
+        'errors': error.to_list()
+    }), 422
+
 @app.route('/api/orders', methods=['POST'])
+@admit_order_writes
 def save_order():
     """Save order from website"""
     try:
@@ -73,22 +463,28 @@ def save_order():
                 'error': 'No data provided'
             }), 400
         
-        # Validate required fields
-        required_fields = ['orderId', 'name', 'phone', 'items', 'address', 'location', 'time', 'total']
-        for field in required_fields:
-            if field not in order_data:
-                return jsonify({
-                    'success': False,
-                    'error': f'Missing required field: {field}'
-                }), 400
+        # Validate and normalize before any database work
+        try:
+            order = schemas.decode_order(order_data)
+        except schemas.SchemaError as e:
+            order_id = order_data.get('orderId') if isinstance(order_data, dict) else None
+            return invalid_order(e, order_id)
+        
+        # Save to database (replays of the same orderId are idempotent)
+        status = db.save_web_order(order)
         
-        # Save to database
-        db.save_web_order(order_data)
+        if status == 'conflict':
+            return jsonify({
+                'success': False,
+                'orderId': order.order_id,
+                'error': 'Order ID already used for a different order'
+            }), 409
         
         return jsonify({
             'success': True,
-            'orderId': order_data['orderId'],
-            'message': 'Order saved successfully'
+            'orderId': order.order_id,
+            'duplicate': status == 'duplicate',
+            'message': 'Order already saved' if status == 'duplicate' else 'Order saved successfully'
         })
     
     except Exception as e:
@@ -97,6 +493,136 @@ def save_order():
             'error': str(e)
         }), 500
 
+@app.route('/api/orders', methods=['GET'])
+@require_api_token
+def list_orders():
+    """List orders newest first with cursor pagination (?cursor=&limit=&status=&direction=next|prev)"""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        direction = request.args.get('direction', 'next')
+        if direction not in ('next', 'prev'):
+            raise ValueError('direction must be next or prev')
+
+        orders, next_cursor, prev_cursor = db.get_web_orders_page(
+            limit=limit,
+            cursor=request.args.get('cursor') or None,
+            status=request.args.get('status') or None,
+            direction=direction
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'orders': [{
+            'orderId': order_id,
+            'name': name,
+            'phone': phone,
+            'total': total,
+            'status': status,
+            'createdAt': created_at
+        } for order_id, name, phone, total, status, created_at in orders],
+        'count': len(orders),
+        'nextCursor': next_cursor,
+        'prevCursor': prev_cursor
+    })
+
+def export_response(name, fmt, make_chunks):
+    """Stream an export as a chunked download, gzipped when the client accepts it"""
+    if fmt not in exports.FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f'Unsupported format: {fmt}'
+        }), 400
+    try:
+        start, end = exports.parse_date_range(request.args.get('from'), request.args.get('to'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    chunks = make_chunks(start, end)
+    headers = {'Content-Disposition': f'attachment; filename={name}.{fmt}', 'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        chunks = exports.gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(chunks, mimetype=mimetype, headers=headers)
+
+@app.route('/api/orders/export', methods=['GET'])
+@require_api_token
+def export_orders():
+    """Stream web orders as CSV or JSONL (?format=&from=&to=)"""
+    fmt = request.args.get('format', 'csv')
+    return export_response('orders', fmt, lambda start, end: exports.export_orders(db, fmt, start, end))
+
+@app.route('/api/analytics/export', methods=['GET'])
+@require_api_token
+def export_analytics():
+    """Stream raw analytics events as CSV or JSONL (?format=&from=&to=&action=)"""
+    fmt = request.args.get('format', 'csv')
+    action = request.args.get('action') or None
+    return export_response('analytics', fmt,
+                           lambda start, end: exports.export_analytics(db, fmt, start, end, action=action))
+
+@app.route('/api/orders/batch', methods=['POST'])
+@admit_order_writes
+def save_orders_batch():
+    """Save many orders in one transaction; accepts a JSON array or {"orders": [...]}"""
+    try:
+        payload = request.get_json(silent=True)
+        orders = payload.get('orders') if isinstance(payload, dict) else payload
+
+        if not isinstance(orders, list) or not orders:
+            return jsonify({
+                'success': False,
+                'error': 'Expected a non-empty array of orders'
+            }), 400
+
+        if len(orders) > ORDER_BATCH_MAX:
+            return jsonify({
+                'success': False,
+                'error': f'Too many orders in one batch (max {ORDER_BATCH_MAX})'
+            }), 413
+
+        # Validate everything first; only valid orders reach the database
+        results = []
+        valid_orders = []
+        for order_data in orders:
+            order_id = order_data.get('orderId') if isinstance(order_data, dict) else None
+            try:
+                order = schemas.decode_order(order_data)
+            except schemas.SchemaError as e:
+                results.append({'orderId': order_id, 'status': 'invalid', 'error': str(e), 'errors': e.to_list()})
+            else:
+                results.append({'orderId': order.order_id, 'status': None})
+                valid_orders.append(order)
+
+        statuses = iter(db.save_web_orders(valid_orders) if valid_orders else [])
+        for result in results:
+            if result['status'] is None:
+                result['status'] = next(statuses)
+
+        counts = {status: sum(1 for r in results if r['status'] == status)
+                  for status in ('saved', 'duplicate', 'conflict', 'invalid')}
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            **counts
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get statistics (for future admin dashboard)"""
@@ -120,6 +646,11 @@ def health_check():
         'service': 'spirit420-api'
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics of the process that took the request, labelled by worker under serve.py"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
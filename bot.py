@@ -1,11 +1,13 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import (Application, CommandHandler, MessageHandler, 
                          CallbackQueryHandler, ContextTypes, filters, ConversationHandler)
 
 from config import *
-from texts import get_text
-from database import db
+from texts import TEXTS, get_text
+from database import db, adb
+import catalog_io
+import metrics
 
 # Enable logging
 logging.basicConfig(
@@ -19,10 +21,14 @@ logger = logging.getLogger(__name__)
  ADMIN_ADD_PRICE, ADMIN_ADD_DESC, ADMIN_ADD_SPECIAL,
  ADMIN_EDIT_SELECT, ADMIN_EDIT_FIELD, ADMIN_EDIT_VALUE) = range(10)
 
+# Telegram rejects longer messages
+TELEGRAM_MESSAGE_LIMIT = 4096
+CATALOG_FOOTER_RESERVE = 64  # "Page x of y" line on catalog pages
+
 # Helper Functions
-def get_user_lang(update: Update) -> str:
+async def get_user_lang(update: Update) -> str:
     """Get user's language preference"""
-    return db.get_user_language(update.effective_user.id)
+    return await adb.get_user_language(update.effective_user.id)
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
@@ -87,19 +93,64 @@ def format_product_card(product, lang):
                    special=special_text,
                    description=desc_text)
 
+class ProductCardCache:
+    """Rendered product cards for every language, keyed by (product_id, lang) at one catalog version
+
+    Rebuilt from the database's catalog listener whenever a newer snapshot
+    is loaded: cards of unchanged products carry over, new and edited ones
+    are rendered, deleted or hidden ones are dropped.
+    """
+
+    def __init__(self, languages):
+        self.languages = tuple(languages)
+        self._state = (None, {})  # (catalog version, {(product_id, lang): card}), swapped as one
+
+    @staticmethod
+    def _short_row(row):
+        return (row[0], row[1], row[3], row[4], row[5], row[6], row[7])
+
+    def on_catalog_change(self, previous, snapshot):
+        """Warm the cards for a new catalog version"""
+        version, old_cards = self._state
+        old_rows = previous.by_id if previous is not None else {}
+        if previous is None or previous.version != version:
+            old_cards = {}
+
+        cards = {}
+        for row in snapshot.active:
+            product_id = row[0]
+            unchanged = old_rows.get(product_id) == row
+            for lang in self.languages:
+                card = old_cards.get((product_id, lang)) if unchanged else None
+                cards[(product_id, lang)] = card or format_product_card(self._short_row(row), lang)
+
+        self._state = (snapshot.version, cards)
+
+    def render(self, catalog, products, lang):
+        """Cards for short product rows of `catalog`, prebuilt where possible"""
+        version, cards = self._state
+        if version != catalog.version:
+            cards = {}
+        return [cards.get((product[0], lang)) or format_product_card(product, lang) for product in products]
+
+    def attach(self, database):
+        """Follow database's catalog changes, starting from its current snapshot"""
+        database.add_catalog_listener(self.on_catalog_change)
+        self.on_catalog_change(None, database.catalog())
+
+card_cache = ProductCardCache(TEXTS)
+
 # ============ COMMAND HANDLERS ============
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
     user = update.effective_user
     
-    # Add user to database
-    db.add_user(user.id, user.username, user.first_name, user.last_name)
-    
-    lang = get_user_lang(update)
+    # Add user to database (also returns their saved language and disclaimer state)
+    lang, disclaimer_accepted = await adb.add_user(user.id, user.username, user.first_name, user.last_name)
     
     # If language is default 'en' and user hasn't accepted disclaimer, show language selection
-    if lang == 'en' and not db.has_accepted_disclaimer(user.id):
+    if lang == 'en' and not disclaimer_accepted:
         await update.message.reply_text(
             '🌿 Welcome to spirit420!\n🌐 Please select your language:\n\nПожалуйста, выберите язык:\nกรุณาเลือกภาษา:',
             reply_markup=get_language_keyboard()
@@ -107,7 +158,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Check if user accepted disclaimer
-    if not db.has_accepted_disclaimer(user.id):
+    if not disclaimer_accepted:
         return await show_disclaimer(update, context)
     
     await update.message.reply_text(
@@ -117,7 +168,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_disclaimer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show age disclaimer"""
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     keyboard = [
         [InlineKeyboardButton(get_text(lang, 'accept_disclaimer'), callback_data='accept_disclaimer')],
@@ -141,9 +192,9 @@ async def accept_disclaimer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    db.accept_disclaimer(user_id)
+    await adb.accept_disclaimer(user_id)
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     await query.edit_message_text(
         get_text(lang, 'welcome'),
@@ -155,7 +206,7 @@ async def decline_disclaimer(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await query.edit_message_text(get_text(lang, 'disclaimer_declined'))
 
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -163,7 +214,7 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     await query.edit_message_text(
         get_text(lang, 'welcome'),
@@ -178,23 +229,86 @@ async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user_id = update.effective_user.id
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     # Log catalog view
-    db.log_action(user_id, 'catalog_view')
+    await adb.log_action(user_id, 'catalog_view')
     
     await query.edit_message_text(
         get_text(lang, 'catalog_disclaimer') + '\n\n' + get_text(lang, 'select_category'),
         reply_markup=get_category_keyboard(lang)
     )
 
+def split_catalog_pages(header, cards, page_size, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Group cards into pages of at most page_size that also fit in one message"""
+    pages, page, length = [], [], len(header)
+    for card in cards:
+        # Room for the "Page x of y" footer and separators
+        card = card[:limit - len(header) - CATALOG_FOOTER_RESERVE]
+        if page and (len(page) >= page_size or length + len(card) + 2 > limit - CATALOG_FOOTER_RESERVE):
+            pages.append(page)
+            page, length = [], len(header)
+        page.append(card)
+        length += len(card) + 2
+    if page:
+        pages.append(page)
+    return pages
+
+def get_pager_keyboard(lang, page, pages, callback_prefix, back_callback):
+    """Prev / page numbers / next row plus a back button; pages are 1-based"""
+    keyboard = []
+    if pages > 1:
+        row = []
+        if page > 1:
+            row.append(InlineKeyboardButton('⬅️', callback_data=f'{callback_prefix}_{page - 1}'))
+        first = max(1, min(page - 2, pages - 4))
+        for number in range(first, min(first + 5, pages + 1)):
+            if number == page:
+                row.append(InlineKeyboardButton(f'· {number} ·', callback_data='noop'))
+            else:
+                row.append(InlineKeyboardButton(str(number), callback_data=f'{callback_prefix}_{number}'))
+        if page < pages:
+            row.append(InlineKeyboardButton('➡️', callback_data=f'{callback_prefix}_{page + 1}'))
+        keyboard.append(row)
+    keyboard.append([InlineKeyboardButton(get_text(lang, 'back'), callback_data=back_callback)])
+    return InlineKeyboardMarkup(keyboard)
+
+async def show_product_page(query, lang, title, cards, page, callback_prefix, back_callback):
+    """Edit the catalog message in place to show one page of product cards"""
+    if not cards:
+        await query.edit_message_text(
+            get_text(lang, 'no_products'),
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton(get_text(lang, 'back'), callback_data=back_callback)
+            ]])
+        )
+        return
+    
+    header = f"{title}\n\n{get_text(lang, 'catalog_disclaimer')}"
+    pages = split_catalog_pages(header, cards, CATALOG_PAGE_SIZE)
+    page = min(max(page, 1), len(pages))  # the catalog may have shrunk since the button was sent
+    
+    text = '\n\n'.join([header] + pages[page - 1])
+    if len(pages) > 1:
+        text += '\n\n' + get_text(lang, 'page_of', page=page, pages=len(pages))
+    
+    await query.edit_message_text(
+        text,
+        reply_markup=get_pager_keyboard(lang, page, len(pages), callback_prefix, back_callback)
+    )
+
+def parse_page(data):
+    """cat_joints_3 / type_sativa_3 -> 3 (page 1 without a suffix)"""
+    parts = data.split('_')
+    return int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1
+
 async def show_category_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show products in selected category or type selection for sorts"""
+    """Show a page of products in the selected category, or the type selection for sorts"""
     query = update.callback_query
     await query.answer()
     
-    lang = get_user_lang(update)
-    category = query.data.split('_')[1]  # cat_sorts -> sorts
+    lang = await get_user_lang(update)
+    category = query.data.split('_')[1]  # cat_sorts -> sorts, cat_joints_2 -> joints
     
     # If sorts, show type selection
     if category == 'sorts':
@@ -205,70 +319,32 @@ async def show_category_products(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     # For joints, show all products
-    products = db.get_products_by_category(category)
-    
-    if not products:
-        await query.edit_message_text(
-            get_text(lang, 'no_products'),
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton(get_text(lang, 'back'), callback_data='catalog')
-            ]])
-        )
-        return
-    
-    # Show products list
-    category_name = CATEGORIES[category][lang]
-    await query.edit_message_text(f"{category_name}\n\n{get_text(lang, 'catalog_disclaimer')}")
-    
-    for product in products:
-        text = format_product_card(product, lang)
-        await query.message.reply_text(text)
-    
-    # Back button
-    await query.message.reply_text(
-        '—',
-        reply_markup=InlineKeyboardMarkup([[
-            InlineKeyboardButton(get_text(lang, 'back'), callback_data='catalog')
-        ]])
-    )
+    catalog = await adb.catalog()
+    cards = card_cache.render(catalog, catalog.by_category.get(category, ()), lang)
+    category_name = CATEGORIES.get(category, {}).get(lang, category)
+    await show_product_page(query, lang, category_name, cards, parse_page(query.data),
+                            f'cat_{category}', 'catalog')
 
 async def show_sorts_by_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show sorts filtered by type"""
+    """Show a page of sorts filtered by type"""
     query = update.callback_query
     await query.answer()
     
-    lang = get_user_lang(update)
-    sort_type = query.data.split('_')[1]  # type_sativa -> sativa
+    lang = await get_user_lang(update)
+    sort_type = query.data.split('_')[1]  # type_sativa -> sativa, type_sativa_2 -> sativa
     
-    products = db.get_products_by_type('sorts', sort_type)
-    
-    if not products:
-        await query.edit_message_text(
-            get_text(lang, 'no_products'),
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton(get_text(lang, 'back'), callback_data='cat_sorts')
-            ]])
-        )
-        return
+    catalog = await adb.catalog()
+    cards = card_cache.render(catalog, catalog.by_type.get(('sorts', sort_type), ()), lang)
     
-    # Show products list
     type_info = PRODUCT_TYPES.get(sort_type, {})
     type_emoji = type_info.get('emoji', '🌿')
     type_name = type_info.get(lang, sort_type)
-    
-    await query.edit_message_text(f"{type_emoji} {type_name}\n\n{get_text(lang, 'catalog_disclaimer')}")
-    
-    for product in products:
-        text = format_product_card(product, lang)
-        await query.message.reply_text(text)
-    
-    # Back button
-    await query.message.reply_text(
-        '—',
-        reply_markup=InlineKeyboardMarkup([[
-            InlineKeyboardButton(get_text(lang, 'back'), callback_data='cat_sorts')
-        ]])
-    )
+    await show_product_page(query, lang, f"{type_emoji} {type_name}", cards, parse_page(query.data),
+                            f'type_{sort_type}', 'cat_sorts')
+
+async def ignore_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer taps on inert buttons (the current page number)"""
+    await update.callback_query.answer()
 
 # ============ INFO HANDLERS ============
 
@@ -277,7 +353,7 @@ async def show_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     if lang == 'ru':
         address = SHOP_ADDRESS_RU
@@ -311,7 +387,7 @@ async def show_map(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await query.message.reply_location(latitude=SHOP_LAT, longitude=SHOP_LON)
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await query.message.reply_text(
         '—',
         reply_markup=InlineKeyboardMarkup([[
@@ -324,7 +400,7 @@ async def show_contacts(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     text = get_text(lang, 'contacts_info')
     
@@ -355,10 +431,10 @@ async def change_language(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     new_lang = query.data.split('_')[1]
     user_id = update.effective_user.id
-    db.set_user_language(user_id, new_lang)
+    await adb.set_user_language(user_id, new_lang)
     
     # If user hasn't accepted disclaimer yet, show it after language selection
-    if not db.has_accepted_disclaimer(user_id):
+    if not await adb.has_accepted_disclaimer(user_id):
         return await show_disclaimer(update, context)
     
     await query.edit_message_text(
@@ -374,12 +450,12 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if not is_admin(user_id):
         if update.message:
-            await update.message.reply_text(get_text(get_user_lang(update), 'access_denied'))
+            await update.message.reply_text(get_text(await get_user_lang(update), 'access_denied'))
         else:
-            await update.callback_query.answer(get_text(get_user_lang(update), 'access_denied'), show_alert=True)
+            await update.callback_query.answer(get_text(await get_user_lang(update), 'access_denied'), show_alert=True)
         return
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     keyboard = [
         [InlineKeyboardButton(get_text(lang, 'add_product'), callback_data='admin_add')],
@@ -408,11 +484,11 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     if not is_admin(update.effective_user.id):
-        await query.answer(get_text(get_user_lang(update), 'access_denied'), show_alert=True)
+        await query.answer(get_text(await get_user_lang(update), 'access_denied'), show_alert=True)
         return
     
-    lang = get_user_lang(update)
-    stats = db.get_stats()
+    lang = await get_user_lang(update)
+    stats = await adb.get_stats()
     
     text = get_text(lang, 'stats',
                    users=stats['users'],
@@ -426,15 +502,23 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def admin_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show recent web orders"""
+    """Show web orders, newest first, with Next/Prev pages"""
     query = update.callback_query
     await query.answer()
     
     if not is_admin(update.effective_user.id):
         return
     
-    lang = get_user_lang(update)
-    orders = db.get_web_orders(limit=10)
+    lang = await get_user_lang(update)
+    
+    # admin_orders -> first page, orders_next_<cursor> / orders_prev_<cursor> -> other pages
+    cursor, direction = None, 'next'
+    if query.data.startswith('orders_'):
+        _, direction, cursor = query.data.split('_', 2)
+    
+    orders, next_cursor, prev_cursor = await adb.get_web_orders_page(
+        limit=10, cursor=cursor, direction=direction
+    )
     
     if not orders:
         await query.edit_message_text(
@@ -450,7 +534,14 @@ async def admin_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         order_id, name, phone, total, status, created_at = order
         text += f"#{order_id}\n👤 {name}\n📱 {phone}\n💰 {total}\n📅 {created_at}\n\n"
     
-    keyboard = [[InlineKeyboardButton(get_text(lang, 'back'), callback_data='admin')]]
+    pager = []
+    if prev_cursor:
+        pager.append(InlineKeyboardButton('⬅️', callback_data=f'orders_prev_{prev_cursor}'))
+    if next_cursor:
+        pager.append(InlineKeyboardButton('➡️', callback_data=f'orders_next_{next_cursor}'))
+    
+    keyboard = [pager] if pager else []
+    keyboard.append([InlineKeyboardButton(get_text(lang, 'back'), callback_data='admin')])
     
     await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
 
@@ -462,9 +553,9 @@ async def admin_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
-    products = db.get_all_products(include_hidden=True)
+    products = await adb.get_all_products(include_hidden=True)
     
     keyboard = []
     for p in products:
@@ -487,9 +578,9 @@ async def toggle_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     product_id = int(query.data.split('_')[1])
-    new_status = db.toggle_product_visibility(product_id)
+    new_status = await adb.toggle_product_visibility(product_id)
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     status_text = get_text(lang, 'product_visible' if new_status else 'product_hidden')
     
     await query.answer(status_text, show_alert=True)
@@ -503,9 +594,9 @@ async def admin_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
-    products = db.get_all_products(include_hidden=True)
+    products = await adb.get_all_products(include_hidden=True)
     
     keyboard = []
     for p in products:
@@ -527,13 +618,63 @@ async def delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     product_id = int(query.data.split('_')[1])
-    db.delete_product(product_id)
+    await adb.delete_product(product_id)
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await query.answer(get_text(lang, 'product_deleted'), show_alert=True)
     
     await admin_panel(update, context)
 
+# ============ CATALOG IMPORT/EXPORT ============
+
+async def admin_import_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Bulk import products from an uploaded CSV/JSONL document"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    lang = await get_user_lang(update)
+    document = update.message.document
+    
+    fmt = catalog_io.detect_format(document.file_name, default=None)
+    if fmt is None:
+        await update.message.reply_text(get_text(lang, 'catalog_import_unsupported'))
+        return
+    
+    telegram_file = await document.get_file()
+    try:
+        text = bytes(await telegram_file.download_as_bytearray()).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Typically a CSV saved from Excel in the local ANSI code page (cp1251, cp874)
+        await update.message.reply_text(get_text(lang, 'catalog_import_bad_encoding'))
+        return
+    
+    rows, report = catalog_io.parse_products(text, fmt)
+    if rows:
+        report.imported = await adb.bulk_upsert_products(rows)
+    
+    reply = get_text(lang, 'catalog_imported', imported=report.imported, errors=len(report.errors))
+    for line, message in report.errors[:10]:
+        reply += f"\n• {line}: {message}"
+    if len(report.errors) > 10:
+        reply += "\n…"
+    
+    await update.message.reply_text(reply)
+
+async def admin_export_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Send the whole catalog as a CSV (or /export_catalog jsonl)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    lang = await get_user_lang(update)
+    fmt = context.args[0] if context.args and context.args[0] in catalog_io.FORMATS else 'csv'
+    
+    products = await adb.get_all_products(include_hidden=True)
+    data = catalog_io.serialize_products(products, fmt).encode('utf-8')
+    await update.message.reply_document(
+        document=InputFile(data, filename=f'catalog.{fmt}'),
+        caption=get_text(lang, 'catalog_exported')
+    )
+
 # ============ ADD PRODUCT CONVERSATION ============
 
 async def admin_add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -544,7 +685,7 @@ async def admin_add_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await query.edit_message_text(get_text(lang, 'enter_product_name'))
     
     return ADMIN_ADD_NAME
@@ -553,7 +694,7 @@ async def admin_add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Receive product name"""
     context.user_data['new_product'] = {'name': update.message.text}
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     keyboard = [
         [InlineKeyboardButton(get_text(lang, 'sorts'), callback_data='addcat_sorts')],
@@ -575,7 +716,7 @@ async def admin_add_category(update: Update, context: ContextTypes.DEFAULT_TYPE)
     category = query.data.split('_')[1]
     context.user_data['new_product']['category'] = category
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     
     keyboard = [
         [InlineKeyboardButton('☀️ Sativa', callback_data='addtype_sativa')],
@@ -598,7 +739,7 @@ async def admin_add_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     product_type = query.data.split('_')[1]
     context.user_data['new_product']['type'] = product_type
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await query.edit_message_text(get_text(lang, 'enter_thc_content'))
     
     return ADMIN_ADD_THC
@@ -609,12 +750,12 @@ async def admin_add_thc(update: Update, context: ContextTypes.DEFAULT_TYPE):
         thc = int(update.message.text)
         context.user_data['new_product']['thc'] = thc
         
-        lang = get_user_lang(update)
+        lang = await get_user_lang(update)
         await update.message.reply_text(get_text(lang, 'enter_price'))
         
         return ADMIN_ADD_PRICE
     except:
-        lang = get_user_lang(update)
+        lang = await get_user_lang(update)
         await update.message.reply_text(get_text(lang, 'invalid_number'))
         return ADMIN_ADD_THC
 
@@ -624,12 +765,12 @@ async def admin_add_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
         price = int(update.message.text)
         context.user_data['new_product']['price'] = price
         
-        lang = get_user_lang(update)
+        lang = await get_user_lang(update)
         await update.message.reply_text(get_text(lang, 'enter_description'))
         
         return ADMIN_ADD_DESC
     except:
-        lang = get_user_lang(update)
+        lang = await get_user_lang(update)
         await update.message.reply_text(get_text(lang, 'invalid_number'))
         return ADMIN_ADD_PRICE
 
@@ -638,7 +779,7 @@ async def admin_add_desc(update: Update, context: ContextTypes.DEFAULT_TYPE):
     desc = update.message.text if update.message.text != '/skip' else ''
     context.user_data['new_product']['description'] = desc
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await update.message.reply_text(get_text(lang, 'enter_special_offer'))
     
     return ADMIN_ADD_SPECIAL
@@ -648,7 +789,7 @@ async def admin_add_special(update: Update, context: ContextTypes.DEFAULT_TYPE):
     special = update.message.text if update.message.text != '/skip' else ''
     product = context.user_data['new_product']
     
-    db.add_product(
+    await adb.add_product(
         name=product['name'],
         category=product['category'],
         product_type=product['type'],
@@ -658,7 +799,7 @@ async def admin_add_special(update: Update, context: ContextTypes.DEFAULT_TYPE):
         special_offer=special
     )
     
-    lang = get_user_lang(update)
+    lang = await get_user_lang(update)
     await update.message.reply_text(get_text(lang, 'product_added'))
     
     # Clear data
@@ -676,10 +817,32 @@ async def cancel_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await admin_panel(update, context)
     return ConversationHandler.END
 
+# ============ METRICS ============
+
+HANDLER_SECONDS = metrics.histogram('spirit420_bot_handler_seconds', 'Bot handler latency in seconds', ('handler',))
+HANDLER_ERRORS = metrics.counter('spirit420_bot_handler_errors_total', 'Bot handler calls that raised', ('handler',))
+
+def instrument_handlers(handlers):
+    """Time every handler callback, including the ones inside conversations"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            instrument_handlers(handler.entry_points)
+            for state_handlers in handler.states.values():
+                instrument_handlers(state_handlers)
+            instrument_handlers(handler.fallbacks)
+        else:
+            name = handler.callback.__name__
+            handler.callback = metrics.timed_async(HANDLER_SECONDS, HANDLER_ERRORS, name)(handler.callback)
+
+async def on_shutdown(application: Application):
+    """Drain pending database calls and flush buffered analytics"""
+    adb.close()
+    db.close()
+
 def main():
     """Start the bot"""
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = Application.builder().token(BOT_TOKEN).post_shutdown(on_shutdown).build()
     
     # Add product conversation handler
     add_product_conv = ConversationHandler(
@@ -699,6 +862,8 @@ def main():
     # Add handlers
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('admin', admin_panel))
+    application.add_handler(CommandHandler('export_catalog', admin_export_catalog))
+    application.add_handler(MessageHandler(filters.Document.ALL, admin_import_catalog))
     application.add_handler(add_product_conv)
     
     application.add_handler(CallbackQueryHandler(accept_disclaimer, pattern='^accept_disclaimer$'))
@@ -707,6 +872,7 @@ def main():
     application.add_handler(CallbackQueryHandler(show_catalog, pattern='^catalog$'))
     application.add_handler(CallbackQueryHandler(show_category_products, pattern='^cat_'))
     application.add_handler(CallbackQueryHandler(show_sorts_by_type, pattern='^type_'))
+    application.add_handler(CallbackQueryHandler(ignore_callback, pattern='^noop$'))
     application.add_handler(CallbackQueryHandler(show_info, pattern='^info$'))
     application.add_handler(CallbackQueryHandler(show_map, pattern='^show_map$'))
     application.add_handler(CallbackQueryHandler(show_contacts, pattern='^contacts$'))
@@ -717,11 +883,19 @@ def main():
     application.add_handler(CallbackQueryHandler(admin_panel, pattern='^admin$'))
     application.add_handler(CallbackQueryHandler(admin_stats, pattern='^admin_stats$'))
     application.add_handler(CallbackQueryHandler(admin_orders, pattern='^admin_orders$'))
+    application.add_handler(CallbackQueryHandler(admin_orders, pattern='^orders_(next|prev)_'))
     application.add_handler(CallbackQueryHandler(admin_toggle, pattern='^admin_toggle$'))
     application.add_handler(CallbackQueryHandler(toggle_product, pattern='^toggle_\d+$'))
     application.add_handler(CallbackQueryHandler(admin_delete, pattern='^admin_delete$'))
     application.add_handler(CallbackQueryHandler(delete_product, pattern='^delete_\d+$'))
     
+    for handlers in application.handlers.values():
+        instrument_handlers(handlers)
+    card_cache.attach(db)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+        logger.info("Metrics listening on port %s", METRICS_PORT)
+    
     # Start bot
     logger.info("Bot started!")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,143 @@
+import csv
+import io
+import json
+
+from config import CATEGORIES, PRODUCT_TYPES
+
+# Column order for export, also the accepted keys for import
+PRODUCT_FIELDS = ('id', 'name', 'category', 'type', 'thc_content', 'price',
+                  'description', 'special_offer', 'is_active')
+
+FORMATS = ('csv', 'jsonl')
+
+class ImportReport:
+    """Outcome of a bulk import: how many rows were written and per-row errors"""
+
+    def __init__(self):
+        self.imported = 0
+        self.errors = []  # (line number, message)
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'errors': [{'line': line, 'error': message} for line, message in self.errors]
+        }
+
+def detect_format(filename, default='csv'):
+    """Guess csv/jsonl from a file name"""
+    name = (filename or '').lower()
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+def _int_field(row, key, required=False, default=None):
+    value = row.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if required:
+            raise ValueError(f'{key} is required')
+        return default
+    if isinstance(value, bool):
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f'{key} must be an integer, got {value!r}')
+
+def validate_product(row):
+    """Validate one product dict and return the tuple bulk_upsert_products expects"""
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+
+    category = str(row.get('category') or '').strip()
+    if category not in CATEGORIES:
+        raise ValueError(f'unknown category {category!r}')
+
+    product_type = str(row.get('type') or '').strip()
+    if product_type not in PRODUCT_TYPES:
+        raise ValueError(f'unknown type {product_type!r}')
+
+    price = _int_field(row, 'price', required=True)
+    if price < 0:
+        raise ValueError('price must not be negative')
+
+    is_active = _int_field(row, 'is_active', default=1)
+    if is_active not in (0, 1):
+        raise ValueError('is_active must be 0 or 1')
+
+    return (
+        _int_field(row, 'id'),
+        name,
+        category,
+        product_type,
+        _int_field(row, 'thc_content'),
+        price,
+        str(row.get('description') or ''),
+        str(row.get('special_offer') or ''),
+        is_active
+    )
+
+def _read_rows(text, fmt):
+    """Yield (line number, dict) from CSV or JSONL text"""
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, e
+                continue
+            yield line_num, row if isinstance(row, dict) else ValueError('expected a JSON object')
+    else:
+        raise ValueError(f'unsupported format {fmt!r}')
+
+def parse_products(text, fmt):
+    """Parse and validate a catalog file; returns (rows, report with the errors)"""
+    report = ImportReport()
+    rows = []
+
+    for line_num, row in _read_rows(text.lstrip('\ufeff'), fmt):
+        if isinstance(row, Exception):
+            report.errors.append((line_num, str(row)))
+            continue
+        try:
+            rows.append(validate_product(row))
+        except ValueError as e:
+            report.errors.append((line_num, str(e)))
+
+    return rows, report
+
+def import_products(database, text, fmt):
+    """Validate a catalog file and upsert every valid row in one transaction"""
+    rows, report = parse_products(text, fmt)
+    if rows:
+        report.imported = database.bulk_upsert_products(rows)
+    return report
+
+def export_products(database, fmt):
+    """Serialize the whole products table (hidden products included)"""
+    return serialize_products(database.get_all_products(include_hidden=True), fmt)
+
+def serialize_products(products, fmt):
+    """Serialize full product rows as CSV or JSONL text"""
+    out = io.StringIO()
+
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(PRODUCT_FIELDS)
+        writer.writerows(products)
+    elif fmt == 'jsonl':
+        for product in products:
+            out.write(json.dumps(dict(zip(PRODUCT_FIELDS, product)), ensure_ascii=False))
+            out.write('\n')
+    else:
+        raise ValueError(f'unsupported format {fmt!r}')
+
+    return out.getvalue()
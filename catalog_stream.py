@@ -0,0 +1,167 @@
+from collections import deque
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def diff_catalog(old, new):
+    """Storefront-visible changes between two catalog snapshots
+
+    Returns {'added': [rows], 'updated': [rows], 'removed': [ids],
+    'visibility': [(id, row or None)]} with empty kinds left out. Hidden
+    products never appear in full: they only show up as a visibility change
+    when they are hidden, or as added/visible once they become active.
+    """
+    added, updated, removed, visibility = [], [], [], []
+
+    for product_id, row in new.by_id.items():
+        before = old.by_id.get(product_id)
+        if before is None:
+            if row[8]:
+                added.append(row)
+        elif before[8] != row[8]:
+            visibility.append((product_id, row if row[8] else None))
+        elif row[8] and before != row:
+            updated.append(row)
+
+    for product_id, before in old.by_id.items():
+        if product_id not in new.by_id and before[8]:
+            removed.append(product_id)
+
+    changes = {'added': added, 'updated': updated, 'removed': removed, 'visibility': visibility}
+    return {kind: items for kind, items in changes.items() if items}
+
+def format_event(event, data, event_id=None):
+    """One Server-Sent Events message"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+class CatalogChangeFeed:
+    """Catalog diffs for SSE subscribers, shared by every connection in the process
+
+    One background thread watches the catalog version, diffs each new
+    snapshot against the previous one and formats the events once. The
+    last `history` diffs are kept so a reconnecting client can resume from
+    its Last-Event-ID (a catalog version); anyone further behind gets a
+    reset event and refetches /api/products. Subscribers sleep on one
+    shared Condition, so an idle connection costs a blocked thread and
+    nothing else.
+    """
+
+    def __init__(self, database, formatter, history=256, poll_interval=1.0):
+        self.database = database
+        self.formatter = formatter  # full product row -> JSON-ready dict
+        self.poll_interval = poll_interval
+        self.subscribers = 0
+        self.closed = False
+        self._history = deque(maxlen=history)  # (from version, to version, formatted events)
+        self._snapshot = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = self.database.catalog()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='catalog-feed', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Catalog feed poll failed")
+
+    def poll(self):
+        """Pick up a new catalog version, if any, and wake the subscribers"""
+        snapshot = self.database.catalog()
+        previous = self._snapshot
+        if snapshot.version <= previous.version:
+            return
+
+        events = self._format_diff(diff_catalog(previous, snapshot), snapshot.version)
+        with self._condition:
+            self._history.append((previous.version, snapshot.version, events))
+            self._snapshot = snapshot
+            self._condition.notify_all()
+
+    def close(self):
+        """End every open stream (clients reconnect and resume elsewhere)"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def _format_diff(self, changes, version):
+        events = []
+        for kind, items in changes.items():
+            if kind in ('added', 'updated'):
+                payload = {'products': [self.formatter(row) for row in items]}
+            elif kind == 'removed':
+                payload = {'ids': items}
+            else:
+                payload = {'changes': [
+                    {'id': product_id, 'active': row is not None,
+                     **({'product': self.formatter(row)} if row is not None else {})}
+                    for product_id, row in items
+                ]}
+            events.append(format_event(kind, {'version': version, **payload}, event_id=version))
+        # A version bump that changed nothing visible still moves the client's Last-Event-ID
+        return ''.join(events) or format_event('version', {'version': version}, event_id=version)
+
+    def _events_since(self, version):
+        """Formatted events after `version`, or None when the history no longer covers it"""
+        if version == self._snapshot.version:
+            return ''
+        for index, (from_version, _, _) in enumerate(self._history):
+            if from_version == version:
+                return ''.join(events for _, _, events in list(self._history)[index:])
+        return None
+
+    def stream(self, last_version=None, heartbeat=15.0, retry_ms=5000):
+        """Generator of SSE text for one subscriber"""
+        self._ensure_started()
+        with self._lock:
+            self.subscribers += 1
+        try:
+            yield f'retry: {retry_ms}\n\n'
+
+            with self._condition:
+                current = self._snapshot.version
+                backlog = None if last_version is None else self._events_since(last_version)
+
+            if backlog:
+                yield backlog
+            elif backlog is None:
+                # New client (or too far behind): tell it which version it is now following
+                event = 'version' if last_version is None else 'reset'
+                yield format_event(event, {'version': current}, event_id=current)
+
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self.closed or self._snapshot.version != current,
+                                             timeout=heartbeat)
+                    if self.closed:
+                        return
+                    pending = self._events_since(current) if self._snapshot.version != current else ''
+                    latest = self._snapshot.version
+
+                if pending is None:
+                    yield format_event('reset', {'version': latest}, event_id=latest)
+                elif pending:
+                    yield pending
+                else:
+                    yield ': heartbeat\n\n'
+                current = latest
+        finally:
+            with self._lock:
+                self.subscribers -= 1
@@ -7,10 +7,87 @@ load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8592268723:AAERL30weAwcS6vCxejXvWKS-kZ72_ZPOpk')
 ADMIN_ID = int(os.getenv('ADMIN_ID', '393004597'))
 
+# API token for admin endpoints (catalog import/export, order listing).
+# Sent as "Authorization: Bearer <token>"; admin endpoints are disabled while empty.
+API_TOKEN = os.getenv('API_TOKEN', '')
+
+# Production API server (python serve.py)
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '2'))              # pre-forked worker processes
+WEB_THREADS = int(os.getenv('WEB_THREADS', '8'))              # request threads per worker
+WEB_GRACEFUL_TIMEOUT = float(os.getenv('WEB_GRACEFUL_TIMEOUT', '30'))  # seconds to finish requests on stop
+WEB_METRICS_PORT = int(os.getenv('WEB_METRICS_PORT', '0'))   # worker N also serves /metrics on this + N; 0 disables
+
+# HTTP caching for GET /api/products (browsers/CDN revalidate with the catalog ETag)
+PRODUCTS_MAX_AGE = int(os.getenv('PRODUCTS_MAX_AGE', '30'))  # seconds
+PRODUCTS_STALE_WHILE_REVALIDATE = int(os.getenv('PRODUCTS_STALE_WHILE_REVALIDATE', '300'))  # seconds
+
+# Largest number of orders accepted by POST /api/orders/batch
+ORDER_BATCH_MAX = int(os.getenv('ORDER_BATCH_MAX', '500'))
+
+# Admission control for order writes (POST /api/orders and /api/orders/batch).
+# Rejected requests get 429 + Retry-After; a rate of 0 disables it. The rates are shared by
+# all serve.py workers; ORDER_MAX_IN_FLIGHT is split evenly between them (at least 1 each).
+ORDER_RATE_PER_CLIENT = float(os.getenv('ORDER_RATE_PER_CLIENT', '0.5'))  # requests/second per client IP
+ORDER_BURST_PER_CLIENT = int(os.getenv('ORDER_BURST_PER_CLIENT', '10'))
+ORDER_RATE_GLOBAL = float(os.getenv('ORDER_RATE_GLOBAL', '20'))           # requests/second overall
+ORDER_BURST_GLOBAL = int(os.getenv('ORDER_BURST_GLOBAL', '50'))
+ORDER_MAX_IN_FLIGHT = int(os.getenv('ORDER_MAX_IN_FLIGHT', '4'))          # concurrent order writes; 0 = unlimited
+ORDER_IN_FLIGHT_WAIT = float(os.getenv('ORDER_IN_FLIGHT_WAIT', '0.1'))    # seconds to wait for a write slot
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000'))  # shared client bucket slots
+# Reverse proxies in front of the API that append to X-Forwarded-For (0 = use the socket address).
+# Set this behind a PaaS router or when orders come through the website's server: otherwise every
+# customer has the proxy's address and shares one ORDER_RATE_PER_CLIENT bucket.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+
 # Website URL (ЗАМЕНИ на свой URL от Vercel!)
 # Пример: https://spirit420-website-abc123.vercel.app
 WEBSITE_URL = os.getenv('WEBSITE_URL', 'https://spirit420-website.vercel.app')
 
+# Database
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'spirit420.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))            # idle connections kept open
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '5'))    # seconds to wait on a locked database
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')        # NORMAL is durable enough under WAL
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))  # prepared statements per connection
+
+# Analytics writer - events are buffered in memory and written in batches
+ANALYTICS_QUEUE_SIZE = int(os.getenv('ANALYTICS_QUEUE_SIZE', '10000'))
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', '500'))
+ANALYTICS_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '2'))  # seconds
+ANALYTICS_OVERFLOW = os.getenv('ANALYTICS_OVERFLOW', 'drop_oldest')  # drop_oldest, drop_newest or block
+
+# Analytics retention - raw events older than this are rolled up per day/action
+# and moved to monthly tables in the archive database (python manage.py compact-analytics)
+ANALYTICS_RETENTION_DAYS = int(os.getenv('ANALYTICS_RETENTION_DAYS', '90'))
+ANALYTICS_ARCHIVE_PATH = os.getenv('ANALYTICS_ARCHIVE_PATH', 'spirit420_archive.db')
+
+# Order/analytics exports (GET /api/orders/export, /api/analytics/export, manage.py export-*)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))  # rows fetched per step
+
+# User profile cache (language + disclaimer state)
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '600'))  # seconds
+
+# Recently seen order IDs (idempotent order submission without a DB round trip)
+ORDER_ID_CACHE_SIZE = int(os.getenv('ORDER_ID_CACHE_SIZE', '10000'))
+ORDER_ID_CACHE_TTL = float(os.getenv('ORDER_ID_CACHE_TTL', '3600'))  # seconds
+
+# Catalog snapshot - how often to check whether another process changed products
+CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL', '1'))  # seconds
+
+# GET /api/products/stream (Server-Sent Events with catalog diffs)
+CATALOG_STREAM_HISTORY = int(os.getenv('CATALOG_STREAM_HISTORY', '256'))      # catalog versions kept for resume
+CATALOG_STREAM_HEARTBEAT = float(os.getenv('CATALOG_STREAM_HEARTBEAT', '15'))  # seconds between heartbeat comments
+CATALOG_STREAM_MAX_SUBSCRIBERS = int(os.getenv('CATALOG_STREAM_MAX_SUBSCRIBERS', '1000'))  # per API process
+
+# Bot catalog browsing - product cards per page of the single catalog message
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '5'))
+
+# Prometheus metrics listener for the bot process (the API serves /metrics itself); 0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
 # Shop Information
 SHOP_NAME = "spirit420"
 WHATSAPP = "+66611483677"
@@ -1,408 +1,1314 @@
 import sqlite3
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import asyncio
+import atexit
+import base64
+import functools
+import hashlib
 import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from config import (DATABASE_PATH, DB_POOL_SIZE, DB_BUSY_TIMEOUT, DB_SYNCHRONOUS,
+                    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE,
+                    ANALYTICS_QUEUE_SIZE, ANALYTICS_BATCH_SIZE, ANALYTICS_FLUSH_INTERVAL,
+                    ANALYTICS_OVERFLOW, USER_CACHE_SIZE, USER_CACHE_TTL, CATALOG_CHECK_INTERVAL,
+                    ORDER_ID_CACHE_SIZE, ORDER_ID_CACHE_TTL, ANALYTICS_RETENTION_DAYS,
+                    ANALYTICS_ARCHIVE_PATH, EXPORT_BATCH_SIZE)
+from cache import LRUCache, MISSING
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ============ MONEY ============
+# Order amounts are stored as integers in minor units (satang, 1/100 baht)
+# and formatted back to the "฿1,200" / "Free" strings the website sends.
+
+CURRENCY_SYMBOL = '฿'
+_AMOUNT_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+def parse_money(value):
+    """Parse an amount like 1200, "฿1,200" or "1200.50" into minor units"""
+    if value is None or isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        text = str(value)
+    else:
+        match = _AMOUNT_RE.search(str(value).replace(',', '').replace(' ', ''))
+        if not match:
+            return 0  # e.g. "Free" delivery
+        text = match.group()
+
+    try:
+        return int((Decimal(text) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except InvalidOperation:
+        return 0
+
+def money_amount(minor):
+    """Minor units back to a plain number of baht (int when whole)"""
+    minor = minor or 0
+    return minor // 100 if minor % 100 == 0 else minor / 100
+
+def format_money(minor):
+    """Minor units to a display string: ฿1,250, ฿1,250.50, or Free for zero"""
+    minor = minor or 0
+    if minor == 0:
+        return 'Free'
+    if minor % 100 == 0:
+        return f"{CURRENCY_SYMBOL}{minor // 100:,}"
+    return f"{CURRENCY_SYMBOL}{minor / 100:,.2f}"
+
+# ============ MIGRATIONS ============
+# Ordered schema changes applied on top of the base tables from init_db.
+# Each step is (version, description, [SQL string or callable(conn)]).
+# Append new steps at the end - never edit or reorder one that has shipped. Data
+# steps use their own frozen helpers, so later changes to shared code can't alter them.
+
+def _rebuild_daily_stats_v3(conn):
+    """daily_stats as migration 3 shipped it: totals were still '฿1200' text"""
+    conn.execute('DELETE FROM daily_stats')
+    conn.execute('''
+        INSERT INTO daily_stats (day, catalog_views, web_orders, revenue)
+        SELECT day, SUM(views), SUM(orders), SUM(revenue)
+        FROM (
+            SELECT DATE(created_at) AS day, COUNT(*) AS views, 0 AS orders, 0 AS revenue
+            FROM analytics
+            WHERE action = 'catalog_view'
+            GROUP BY DATE(created_at)
+
+            UNION ALL
+
+            SELECT DATE(created_at), 0, COUNT(*), COALESCE(SUM(CAST(REPLACE(total, '฿', '') AS INTEGER)), 0)
+            FROM web_orders
+            GROUP BY DATE(created_at)
+        )
+        GROUP BY day
+    ''')
+
+def _rebuild_daily_stats_v4(conn):
+    """daily_stats as migration 4 shipped it: totals in minor units, no analytics rollup yet"""
+    conn.execute('DELETE FROM daily_stats')
+    conn.execute('''
+        INSERT INTO daily_stats (day, catalog_views, web_orders, revenue)
+        SELECT day, SUM(views), SUM(orders), SUM(revenue)
+        FROM (
+            SELECT DATE(created_at) AS day, COUNT(*) AS views, 0 AS orders, 0 AS revenue
+            FROM analytics
+            WHERE action = 'catalog_view'
+            GROUP BY DATE(created_at)
+
+            UNION ALL
+
+            SELECT DATE(created_at), 0, COUNT(*), COALESCE(SUM(total), 0)
+            FROM web_orders
+            GROUP BY DATE(created_at)
+        )
+        GROUP BY day
+    ''')
+
+def convert_order_money_columns(conn):
+    """Rebuild web_orders with subtotal/delivery_cost/total as INTEGER minor units"""
+    conn.create_function('parse_money', 1, parse_money, deterministic=True)
+    conn.execute('''
+        CREATE TABLE web_orders_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id TEXT UNIQUE NOT NULL,
+            customer_name TEXT NOT NULL,
+            customer_phone TEXT NOT NULL,
+            items TEXT NOT NULL,
+            address TEXT NOT NULL,
+            location_lat REAL,
+            location_lng REAL,
+            delivery_time TEXT NOT NULL,
+            comment TEXT,
+            subtotal INTEGER NOT NULL,
+            delivery_cost INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            status TEXT DEFAULT 'new',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO web_orders_new
+        SELECT id, order_id, customer_name, customer_phone, items, address,
+               location_lat, location_lng, delivery_time, comment,
+               parse_money(subtotal), parse_money(delivery_cost), parse_money(total),
+               status, created_at
+        FROM web_orders
+    ''')
+    # Dropping the old table also drops its indexes and triggers
+    conn.execute('DROP TABLE web_orders')
+    conn.execute('ALTER TABLE web_orders_new RENAME TO web_orders')
+    conn.execute('CREATE INDEX idx_web_orders_created ON web_orders (created_at, total)')
+    conn.execute('''
+        CREATE TRIGGER trg_web_orders_daily_stats AFTER INSERT ON web_orders
+        BEGIN
+            INSERT INTO daily_stats (day, web_orders, revenue)
+            VALUES (DATE(NEW.created_at), 1, NEW.total)
+            ON CONFLICT (day) DO UPDATE SET web_orders = web_orders + 1,
+                                            revenue = revenue + excluded.revenue;
+        END
+    ''')
+    _rebuild_daily_stats_v4(conn)
+
+MIGRATIONS = [
+    (1, 'Indexes for catalog, order and analytics queries', [
+        # get_products_by_type: category = ? AND type = ? AND is_active = 1 ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_products_category_type ON products (category, type, is_active, created_at)',
+        # get_products_by_category: category = ? AND is_active = 1 ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, is_active, created_at)',
+        # get_all_products / active product count
+        'CREATE INDEX IF NOT EXISTS idx_products_active ON products (is_active, created_at)',
+        # get_web_orders ORDER BY created_at, covering for the revenue sum
+        'CREATE INDEX IF NOT EXISTS idx_web_orders_created ON web_orders (created_at, total)',
+        # catalog views per day, covering for COUNT(*)
+        'CREATE INDEX IF NOT EXISTS idx_analytics_action_created ON analytics (action, created_at)',
+    ]),
+    (2, 'Catalog version counter bumped on every products change', [
+        '''
+        CREATE TABLE IF NOT EXISTS catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        'INSERT OR IGNORE INTO catalog_meta (id, version) VALUES (1, 1)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_insert_version AFTER INSERT ON products
+        BEGIN
+            UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_update_version AFTER UPDATE ON products
+        BEGIN
+            UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_delete_version AFTER DELETE ON products
+        BEGIN
+            UPDATE catalog_meta SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+    ]),
+    (3, 'Daily stats rollup maintained by triggers', [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            catalog_views INTEGER NOT NULL DEFAULT 0,
+            web_orders INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_analytics_daily_stats AFTER INSERT ON analytics
+        WHEN NEW.action = 'catalog_view'
+        BEGIN
+            INSERT INTO daily_stats (day, catalog_views) VALUES (DATE(NEW.created_at), 1)
+            ON CONFLICT (day) DO UPDATE SET catalog_views = catalog_views + 1;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_web_orders_daily_stats AFTER INSERT ON web_orders
+        BEGIN
+            INSERT INTO daily_stats (day, web_orders, revenue)
+            VALUES (DATE(NEW.created_at), 1, CAST(REPLACE(NEW.total, '฿', '') AS INTEGER))
+            ON CONFLICT (day) DO UPDATE SET web_orders = web_orders + 1,
+                                            revenue = revenue + excluded.revenue;
+        END
+        ''',
+        _rebuild_daily_stats_v3,
+    ]),
+    (4, 'Store order amounts as INTEGER minor units', [
+        convert_order_money_columns,
+    ]),
+    (5, 'Payload hash for idempotent order submission', [
+        'ALTER TABLE web_orders ADD COLUMN payload_hash TEXT',
+    ]),
+    (6, 'Keyset pagination indexes on web_orders (created_at, id)', [
+        # Same covering role for revenue sums, now also ordered by id within a timestamp
+        'DROP INDEX IF EXISTS idx_web_orders_created',
+        'CREATE INDEX idx_web_orders_created ON web_orders (created_at, id, total)',
+        'CREATE INDEX IF NOT EXISTS idx_web_orders_status_created ON web_orders (status, created_at, id)',
+    ]),
+    (7, 'Per-day/per-action rollup for compacted analytics', [
+        '''
+        CREATE TABLE IF NOT EXISTS analytics_daily (
+            day TEXT NOT NULL,
+            action TEXT NOT NULL,
+            events INTEGER NOT NULL DEFAULT 0,
+            users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, action)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (8, 'Date-range index on analytics for exports and compaction', [
+        'CREATE INDEX IF NOT EXISTS idx_analytics_created ON analytics (created_at)',
+    ]),
+]
+
+def rebuild_daily_stats(conn):
+    """Recompute daily_stats from analytics (live and compacted) and web_orders
+
+    Migrations keep their own frozen copies; this one follows the current schema.
+    """
+    conn.execute('DELETE FROM daily_stats')
+    conn.execute('''
+        INSERT INTO daily_stats (day, catalog_views, web_orders, revenue)
+        SELECT day, SUM(views), SUM(orders), SUM(revenue)
+        FROM (
+            SELECT DATE(created_at) AS day, COUNT(*) AS views, 0 AS orders, 0 AS revenue
+            FROM analytics
+            WHERE action = 'catalog_view'
+            GROUP BY DATE(created_at)
+
+            UNION ALL
+
+            -- Days already compacted out of analytics only survive in analytics_daily
+            SELECT day, events, 0, 0
+            FROM analytics_daily
+            WHERE action = 'catalog_view'
+
+            UNION ALL
+
+            SELECT DATE(created_at), 0, COUNT(*), COALESCE(SUM(total), 0)
+            FROM web_orders
+            GROUP BY DATE(created_at)
+        )
+        GROUP BY day
+    ''')
+
+def order_payload_hash(order_data):
+    """Stable fingerprint of an order payload, used to tell retries from conflicts"""
+    canonical = json.dumps(order_data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def encode_cursor(created_at, row_id):
+    """Opaque pagination cursor for a (created_at, id) position"""
+    raw = f"{created_at}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return created_at, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f'Invalid cursor: {cursor!r}')
+
+def _created_at_range(start=None, end=None):
+    """WHERE clause and params for created_at in [start, end), either bound optional"""
+    conditions, params = ['1 = 1'], []
+    if start:
+        conditions.append('created_at >= ?')
+        params.append(start)
+    if end:
+        conditions.append('created_at < ?')
+        params.append(end)
+    return ' AND '.join(conditions), params
+
+def utc_timestamp():
+    """Current UTC time in the same format as CURRENT_TIMESTAMP"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class AnalyticsWriter:
+    """Buffers analytics events in a bounded queue and writes them in batches
+
+    A background thread flushes a batch when it reaches batch_size or when
+    flush_interval seconds have passed since its first event. When the queue
+    is full the overflow policy decides what happens: drop_oldest discards
+    the oldest buffered event, drop_newest discards the new one and block
+    waits for room (up to flush_interval). After close() events are written
+    synchronously instead, so a late log_action can't start a new thread.
+    """
+
+    def __init__(self, database, max_size=ANALYTICS_QUEUE_SIZE, batch_size=ANALYTICS_BATCH_SIZE,
+                 flush_interval=ANALYTICS_FLUSH_INTERVAL, overflow=ANALYTICS_OVERFLOW):
+        self.database = database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def qsize(self):
+        """Number of buffered events"""
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        """Start the background thread if needed; False once the writer is closed"""
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._closed:
+                    return False
+                if self._thread is None or not self._thread.is_alive():
+                    self._stopping.clear()
+                    self._thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+                    self._thread.start()
+        return True
+
+    def enqueue(self, user_id, action, details=''):
+        """Buffer an event; never touches the database while the writer is open"""
+        event = (user_id, action, details, utc_timestamp())
+        if not self._ensure_started():
+            self._write([event])
+            return
+
+        try:
+            self._queue.put_nowait(event)
+            if self._closed:
+                self.flush()  # close() may have done its final flush just before our put
+            return
+        except queue.Full:
+            pass
+
+        if self.overflow == 'block':
+            try:
+                self._queue.put(event, timeout=self.flush_interval)
+                return
+            except queue.Full:
+                pass
+        elif self.overflow == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+
+        with self._lock:
+            self.dropped += 1
+            dropped = self.dropped
+        if dropped % 1000 == 1:
+            logger.warning("Analytics queue full, %s events dropped so far", dropped)
+
+    def _next_batch(self):
+        """Wait for the first event, then collect more until the batch is full or due"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _drain(self):
+        """Take everything currently buffered without waiting"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch):
+        try:
+            with self.database.transaction() as conn:
+                conn.executemany('''
+                    INSERT INTO analytics (user_id, action, details, created_at)
+                    VALUES (?, ?, ?, ?)
+                ''', batch)
+        except sqlite3.Error:
+            logger.exception("Failed to write %s analytics events", len(batch))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write all buffered events now, from the calling thread"""
+        batch = self._drain()
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+
+    def close(self):
+        """Stop the background thread for good and flush whatever is left"""
+        with self._lock:
+            self._closed = True
+            self._stopping.set()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+class CatalogSnapshot:
+    """Immutable, indexed view of the products table at one catalog version
+
+    Rows keep the tuple shapes the Database getters have always returned:
+    full rows (id, name, category, type, thc_content, price, description,
+    special_offer, is_active) and short rows (id, name, type, thc_content,
+    price, description, special_offer) for the per-category listings.
+    """
+
+    __slots__ = ('version', 'products', 'active', 'by_id', 'by_category', 'by_type',
+                 'active_by_category', 'active_by_type')
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.products = tuple(rows)
+        self.active = tuple(row for row in self.products if row[8])
+        self.by_id = {row[0]: row for row in self.products}
+
+        by_category = {}
+        by_type = {}
+        active_by_category = {}
+        active_by_type = {}  # (category, type) and (None, type) -> full rows
+        for row in self.active:
+            short_row = (row[0], row[1], row[3], row[4], row[5], row[6], row[7])
+            by_category.setdefault(row[2], []).append(short_row)
+            by_type.setdefault((row[2], row[3]), []).append(short_row)
+            active_by_category.setdefault(row[2], []).append(row)
+            active_by_type.setdefault((row[2], row[3]), []).append(row)
+            active_by_type.setdefault((None, row[3]), []).append(row)
+
+        self.by_category = {key: tuple(value) for key, value in by_category.items()}
+        self.by_type = {key: tuple(value) for key, value in by_type.items()}
+        self.active_by_category = {key: tuple(value) for key, value in active_by_category.items()}
+        self.active_by_type = {key: tuple(value) for key, value in active_by_type.items()}
+
+    def select(self, category=None, product_type=None):
+        """Active full rows for a category and/or type, newest first"""
+        if product_type:
+            return self.active_by_type.get((category or None, product_type), ())
+        if category:
+            return self.active_by_category.get(category, ())
+        return self.active
+
+# Pools inherited from a parent process. SQLite handles must not be used or
+# closed across fork(), so a forked child parks them here and opens its own.
+_inherited_pools = []
 
 class Database:
-    def __init__(self, db_name='spirit420.db'):
+    def __init__(self, db_name=DATABASE_PATH, pool_size=DB_POOL_SIZE):
         self.db_name = db_name
+        self.pool_size = pool_size
+        self._catalog_listeners = []
+        self._init_process_state()
         self.init_db()
-        
-    def get_connection(self):
-        return sqlite3.connect(self.db_name)
-    
+        atexit.register(self.close)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _init_process_state(self):
+        """Connections, caches and background writer owned by the current process"""
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self.analytics = AnalyticsWriter(self)
+        self.user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self.recent_orders = LRUCache(ORDER_ID_CACHE_SIZE, ORDER_ID_CACHE_TTL)  # order_id -> payload hash
+        self._catalog = None
+        self._catalog_checked_at = 0.0
+        self._catalog_lock = threading.Lock()
+
+    def _after_fork(self):
+        """Start a forked child (e.g. a pre-fork API worker) with fresh per-process state"""
+        _inherited_pools.append(self._pool)
+        self._init_process_state()
+
+    # ============ CONNECTION MANAGEMENT ============
+
+    def _connect(self):
+        """Open a new connection with our pragmas applied"""
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,  # connections move between threads through the pool
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+        conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a long-lived connection from the pool"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit on success, roll back on error"""
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        """Flush buffered analytics and close all pooled connections (shutdown hook)"""
+        self.analytics.close()
+
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
     def init_db(self):
         """Initialize database with tables"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                language TEXT DEFAULT 'en',
-                disclaimer_accepted INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Products table - ОБНОВЛЕННАЯ для веб-сайта
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                category TEXT NOT NULL,
-                type TEXT NOT NULL,
-                thc_content INTEGER,
-                price INTEGER NOT NULL,
-                description TEXT,
-                special_offer TEXT,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Orders table - для заказов с сайта
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS web_orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id TEXT UNIQUE NOT NULL,
-                customer_name TEXT NOT NULL,
-                customer_phone TEXT NOT NULL,
-                items TEXT NOT NULL,
-                address TEXT NOT NULL,
-                location_lat REAL,
-                location_lng REAL,
-                delivery_time TEXT NOT NULL,
-                comment TEXT,
-                subtotal TEXT NOT NULL,
-                delivery_cost TEXT NOT NULL,
-                total TEXT NOT NULL,
-                status TEXT DEFAULT 'new',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Analytics table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analytics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action TEXT NOT NULL,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+
+            # Users table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    language TEXT DEFAULT 'en',
+                    disclaimer_accepted INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Products table - ОБНОВЛЕННАЯ для веб-сайта
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS products (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    thc_content INTEGER,
+                    price INTEGER NOT NULL,
+                    description TEXT,
+                    special_offer TEXT,
+                    is_active INTEGER DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Orders table - для заказов с сайта
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS web_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id TEXT UNIQUE NOT NULL,
+                    customer_name TEXT NOT NULL,
+                    customer_phone TEXT NOT NULL,
+                    items TEXT NOT NULL,
+                    address TEXT NOT NULL,
+                    location_lat REAL,
+                    location_lng REAL,
+                    delivery_time TEXT NOT NULL,
+                    comment TEXT,
+                    subtotal TEXT NOT NULL,
+                    delivery_cost TEXT NOT NULL,
+                    total TEXT NOT NULL,
+                    status TEXT DEFAULT 'new',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Analytics table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analytics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    action TEXT NOT NULL,
+                    details TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+        self.migrate()
+
+    def migrate(self):
+        """Apply pending schema migrations in order"""
+        with self.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            applied = {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+
+            for version, description, steps in MIGRATIONS:
+                if version in applied:
+                    continue
+
+                with conn:
+                    # Take the write lock first so the bot and API can't both apply a step
+                    conn.execute('BEGIN IMMEDIATE')
+                    if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                        continue
+
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+
+                    conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                                 (version, description))
+                    logger.info("Applied migration %s: %s", version, description)
+
+    def get_schema_version(self):
+        """Get the latest applied migration version"""
+        with self.connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
     # ============ USER METHODS ============
-    
+
     def add_user(self, user_id, username, first_name, last_name, language='en'):
-        """Add or update user"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, language)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name, language))
-        
-        conn.commit()
-        conn.close()
-    
+        """Add user or refresh their profile fields; returns (language, disclaimer_accepted)"""
+        # A real upsert: an existing row keeps its language, disclaimer and created_at
+        with self.transaction() as conn:
+            row = conn.execute('''
+                INSERT INTO users (user_id, username, first_name, last_name, language)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                RETURNING language, disclaimer_accepted
+            ''', (user_id, username, first_name, last_name, language)).fetchone()
+
+        profile = (row[0] or 'en', bool(row[1]))
+        self.user_cache.set(user_id, profile)
+        return profile
+
+    def get_user_profile(self, user_id):
+        """Get (language, disclaimer_accepted) for a user, served from cache when possible"""
+        profile = self.user_cache.get(user_id)
+        if profile is not MISSING:
+            return profile
+
+        with self.connection() as conn:
+            result = conn.execute(
+                'SELECT language, disclaimer_accepted FROM users WHERE user_id = ?', (user_id,)
+            ).fetchone()
+
+        profile = (result[0] or 'en', bool(result[1])) if result else ('en', False)
+        self.user_cache.set(user_id, profile)
+        return profile
+
     def get_user_language(self, user_id):
         """Get user's language preference"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT language FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        conn.close()
-        return result[0] if result else 'en'
-    
+        return self.get_user_profile(user_id)[0]
+
     def set_user_language(self, user_id, language):
         """Set user's language preference"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE users SET language = ? WHERE user_id = ?', (language, user_id))
-        
-        conn.commit()
-        conn.close()
-    
+        with self.transaction() as conn:
+            row = conn.execute(
+                'UPDATE users SET language = ? WHERE user_id = ? RETURNING language, disclaimer_accepted',
+                (language, user_id)
+            ).fetchone()
+
+        self._cache_user_row(user_id, row)
+
     def has_accepted_disclaimer(self, user_id):
         """Check if user accepted disclaimer"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT disclaimer_accepted FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
-        
-        conn.close()
-        return bool(result and result[0]) if result else False
-    
+        return self.get_user_profile(user_id)[1]
+
     def accept_disclaimer(self, user_id):
         """Mark user as accepted disclaimer"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE users SET disclaimer_accepted = 1 WHERE user_id = ?', (user_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        with self.transaction() as conn:
+            row = conn.execute(
+                'UPDATE users SET disclaimer_accepted = 1 WHERE user_id = ? RETURNING language, disclaimer_accepted',
+                (user_id,)
+            ).fetchone()
+
+        self._cache_user_row(user_id, row)
+
+    def _cache_user_row(self, user_id, row):
+        """Write-through an updated users row (or forget the user if nothing was updated)"""
+        if row:
+            self.user_cache.set(user_id, (row[0] or 'en', bool(row[1])))
+        else:
+            self.user_cache.pop(user_id)
+
     # ============ PRODUCT METHODS ============
-    
-    def add_product(self, name, category, product_type, thc_content, price, 
+
+    # Reads are served from an in-memory CatalogSnapshot. Mutations made here
+    # rebuild it straight away; changes made by another process (bot vs API)
+    # are noticed through catalog_meta.version within CATALOG_CHECK_INTERVAL.
+
+    def catalog(self):
+        """Get the current catalog snapshot"""
+        snapshot = self._catalog
+        now = time.monotonic()
+        if snapshot is not None and now - self._catalog_checked_at < CATALOG_CHECK_INTERVAL:
+            return snapshot
+
+        self._catalog_checked_at = now
+        with self.connection() as conn:
+            version = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        return self.refresh_catalog()
+
+    def refresh_catalog(self):
+        """Rebuild the catalog snapshot from the database and swap it in"""
+        with self._catalog_lock:
+            with self.connection() as conn:
+                # One read transaction so the version matches the rows
+                with conn:
+                    conn.execute('BEGIN')
+                    version = conn.execute('SELECT version FROM catalog_meta WHERE id = 1').fetchone()[0]
+                    rows = conn.execute('''
+                        SELECT id, name, category, type, thc_content, price,
+                               description, special_offer, is_active
+                        FROM products
+                        ORDER BY created_at DESC, id DESC
+                    ''').fetchall()
+
+            current = self._catalog
+            if current is None or version > current.version:
+                self._catalog = CatalogSnapshot(version, rows)
+                self._notify_catalog_listeners(current, self._catalog)
+            self._catalog_checked_at = time.monotonic()
+            return self._catalog
+
+    def add_catalog_listener(self, callback):
+        """Call callback(previous snapshot or None, new snapshot) whenever a newer catalog is loaded"""
+        self._catalog_listeners.append(callback)
+
+    def _notify_catalog_listeners(self, previous, snapshot):
+        for callback in self._catalog_listeners:
+            try:
+                callback(previous, snapshot)
+            except Exception:
+                logger.exception("Catalog listener %r failed", callback)
+
+    def get_catalog_version(self):
+        """Get the catalog version (increases on every products change)"""
+        return self.catalog().version
+
+    def add_product(self, name, category, product_type, thc_content, price,
                    description='', special_offer=''):
         """Add new product"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO products (name, category, type, thc_content, price, description, special_offer)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (name, category, product_type, thc_content, price, description, special_offer))
-        
-        product_id = cursor.lastrowid
-        
-        conn.commit()
-        conn.close()
-        
-        return product_id
-    
+        with self.transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO products (name, category, type, thc_content, price, description, special_offer)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (name, category, product_type, thc_content, price, description, special_offer))
+
+        self.refresh_catalog()
+        return cursor.lastrowid
+
+    def bulk_upsert_products(self, rows):
+        """Insert or update many products in one transaction
+
+        rows are (id, name, category, type, thc_content, price, description,
+        special_offer, is_active); a None id inserts a new product.
+        """
+        with self.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO products (id, name, category, type, thc_content, price,
+                                      description, special_offer, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    name = excluded.name,
+                    category = excluded.category,
+                    type = excluded.type,
+                    thc_content = excluded.thc_content,
+                    price = excluded.price,
+                    description = excluded.description,
+                    special_offer = excluded.special_offer,
+                    is_active = excluded.is_active
+            ''', rows)
+
+        self.refresh_catalog()
+        return len(rows)
+
     def get_all_products(self, include_hidden=False):
         """Get all products"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if include_hidden:
-            cursor.execute('''
-                SELECT id, name, category, type, thc_content, price, 
-                       description, special_offer, is_active
-                FROM products
-                ORDER BY created_at DESC
-            ''')
-        else:
-            cursor.execute('''
-                SELECT id, name, category, type, thc_content, price, 
-                       description, special_offer, is_active
-                FROM products
-                WHERE is_active = 1
-                ORDER BY created_at DESC
-            ''')
-        
-        products = cursor.fetchall()
-        conn.close()
-        
-        return products
-    
+        catalog = self.catalog()
+        return catalog.products if include_hidden else catalog.active
+
     def get_products_by_category(self, category):
         """Get products by category"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, type, thc_content, price, description, special_offer
-            FROM products
-            WHERE category = ? AND is_active = 1
-            ORDER BY created_at DESC
-        ''', (category,))
-        
-        products = cursor.fetchall()
-        conn.close()
-        
-        return products
-    
+        return self.catalog().by_category.get(category, ())
+
     def get_products_by_type(self, category, product_type):
         """Get products by category and type"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, type, thc_content, price, description, special_offer
-            FROM products
-            WHERE category = ? AND type = ? AND is_active = 1
-            ORDER BY created_at DESC
-        ''', (category, product_type))
-        
-        products = cursor.fetchall()
-        conn.close()
-        
-        return products
-    
+        return self.catalog().by_type.get((category, product_type), ())
+
     def get_product(self, product_id):
         """Get product by ID"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, category, type, thc_content, price, description, special_offer, is_active
-            FROM products
-            WHERE id = ?
-        ''', (product_id,))
-        
-        product = cursor.fetchone()
-        conn.close()
-        
-        return product
-    
+        return self.catalog().by_id.get(product_id)
+
     def update_product(self, product_id, **kwargs):
         """Update product fields"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
         # Build update query dynamically
         fields = []
         values = []
         for key, value in kwargs.items():
             fields.append(f"{key} = ?")
             values.append(value)
-        
+
         values.append(product_id)
         query = f"UPDATE products SET {', '.join(fields)} WHERE id = ?"
-        
-        cursor.execute(query, values)
-        
-        conn.commit()
-        conn.close()
-    
+
+        with self.transaction() as conn:
+            conn.execute(query, values)
+
+        self.refresh_catalog()
+
     def delete_product(self, product_id):
         """Delete product"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM products WHERE id = ?', (product_id,))
-        
-        conn.commit()
-        conn.close()
-    
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM products WHERE id = ?', (product_id,))
+
+        self.refresh_catalog()
+
     def toggle_product_visibility(self, product_id):
         """Toggle product visibility"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT is_active FROM products WHERE id = ?', (product_id,))
-        result = cursor.fetchone()
-        
-        if result:
-            new_status = 0 if result[0] else 1
-            cursor.execute('UPDATE products SET is_active = ? WHERE id = ?', (new_status, product_id))
-            conn.commit()
-            conn.close()
-            return new_status
-        
-        conn.close()
-        return None
-    
+        with self.transaction() as conn:
+            result = conn.execute('SELECT is_active FROM products WHERE id = ?', (product_id,)).fetchone()
+
+            new_status = None
+            if result:
+                new_status = 0 if result[0] else 1
+                conn.execute('UPDATE products SET is_active = ? WHERE id = ?', (new_status, product_id))
+
+        if new_status is not None:
+            self.refresh_catalog()
+        return new_status
+
     # ============ WEB ORDER METHODS ============
-    
-    def save_web_order(self, order_data):
-        """Save order from website"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+
+    # Orders are idempotent on orderId: replaying an order with the same payload
+    # is a 'duplicate' (the original success), a different payload under an
+    # existing orderId is a 'conflict'. Recently seen IDs are answered from
+    # self.recent_orders so retry storms don't reach SQLite. The cache is only
+    # filled once the transaction has committed: until then a retry must wait
+    # on SQLite, since the order may still be rolled back.
+
+    @staticmethod
+    def _web_order_params(order, payload_hash):
+        """Build the web_orders INSERT parameters from a decoded schemas.Order"""
+        return (
+            order.order_id,
+            order.name,
+            order.phone,
+            order.items_json(),
+            order.address,
+            order.lat,
+            order.lng,
+            order.time,
+            order.comment,
+            order.subtotal,
+            order.delivery,
+            order.total,
+            payload_hash
+        )
+
+    @staticmethod
+    def _replay_status(stored_hash, payload_hash):
+        # Orders saved before payload hashes existed can't be compared; accept the replay
+        return 'duplicate' if stored_hash is None or stored_hash == payload_hash else 'conflict'
+
+    def _insert_web_order(self, conn, order):
+        """Insert one order on conn; returns (status, stored payload hash or MISSING)
+
+        status is 'saved', 'duplicate' or 'conflict'. The hash is MISSING when
+        the answer came from self.recent_orders and there is nothing to cache.
+        """
+        order_id = order.order_id
+        payload_hash = order.payload_hash()
+
+        stored_hash = self.recent_orders.get(order_id)
+        if stored_hash is not MISSING:
+            return self._replay_status(stored_hash, payload_hash), MISSING
+
+        cursor = conn.execute('''
             INSERT INTO web_orders (
                 order_id, customer_name, customer_phone, items, address,
                 location_lat, location_lng, delivery_time, comment,
-                subtotal, delivery_cost, total
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            str(order_data['orderId']),
-            order_data['name'],
-            order_data['phone'],
-            json.dumps(order_data['items'], ensure_ascii=False),
-            order_data['address'],
-            order_data['location']['lat'],
-            order_data['location']['lng'],
-            order_data['time'],
-            order_data.get('comment', ''),
-            order_data['subtotal'],
-            order_data['delivery'],
-            order_data['total']
-        ))
-        
-        conn.commit()
-        conn.close()
-    
+                subtotal, delivery_cost, total, payload_hash
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (order_id) DO NOTHING
+        ''', self._web_order_params(order, payload_hash))
+
+        if cursor.rowcount:
+            status, stored_hash = 'saved', payload_hash
+        else:
+            stored_hash = conn.execute(
+                'SELECT payload_hash FROM web_orders WHERE order_id = ?', (order_id,)
+            ).fetchone()[0]
+            status = self._replay_status(stored_hash, payload_hash)
+
+        return status, stored_hash
+
+    def save_web_order(self, order):
+        """Save a decoded website order; returns 'saved', 'duplicate' or 'conflict'"""
+        with self.transaction() as conn:
+            status, stored_hash = self._insert_web_order(conn, order)
+        if stored_hash is not MISSING:
+            self.recent_orders.set(order.order_id, stored_hash)
+        return status
+
+    def save_web_orders(self, orders):
+        """Save many decoded website orders in one transaction
+
+        Returns one status per order, in order: 'saved', 'duplicate' (same
+        orderId and payload already stored, or repeated earlier in the batch)
+        or 'conflict' (orderId already used by a different payload).
+        """
+        with self.transaction() as conn:
+            results = [self._insert_web_order(conn, order) for order in orders]
+        for order, (_, stored_hash) in zip(orders, results):
+            if stored_hash is not MISSING:
+                self.recent_orders.set(order.order_id, stored_hash)
+        return [status for status, _ in results]
+
     def get_web_orders(self, limit=50):
         """Get recent web orders"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT order_id, customer_name, customer_phone, total, status, created_at
-            FROM web_orders
-            ORDER BY created_at DESC
-            LIMIT ?
-        ''', (limit,))
-        
-        orders = cursor.fetchall()
-        conn.close()
-        
-        return orders
-    
+        with self.connection() as conn:
+            rows = conn.execute('''
+                SELECT order_id, customer_name, customer_phone, total, status, created_at
+                FROM web_orders
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            ''', (limit,)).fetchall()
+
+        return [(order_id, name, phone, format_money(total), status, created_at)
+                for order_id, name, phone, total, status, created_at in rows]
+
+    def get_web_orders_page(self, limit=20, cursor=None, status=None, direction='next'):
+        """Get one page of web orders, newest first, using keyset pagination
+
+        cursor comes from a previous page's next_cursor (with direction='next')
+        or prev_cursor (with direction='prev'). Every page is an index range
+        scan on (created_at, id), so deep pages cost the same as the first.
+        Returns (orders, next_cursor, prev_cursor); rows are shaped like
+        get_web_orders and a cursor is None when there is no such page.
+        """
+        conditions = []
+        params = []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+
+        backwards = direction == 'prev'
+        if cursor:
+            conditions.append('(created_at, id) > (?, ?)' if backwards else '(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'ASC' if backwards else 'DESC'
+
+        with self.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT id, order_id, customer_name, customer_phone, total, status, created_at
+                FROM web_orders
+                {where}
+                ORDER BY created_at {order}, id {order}
+                LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        if not rows:
+            return [], None, None
+
+        first_cursor = encode_cursor(rows[0][6], rows[0][0])
+        last_cursor = encode_cursor(rows[-1][6], rows[-1][0])
+        if backwards:
+            next_cursor, prev_cursor = last_cursor, first_cursor if has_more else None
+        else:
+            next_cursor, prev_cursor = last_cursor if has_more else None, first_cursor if cursor else None
+
+        orders = [(order_id, name, phone, format_money(total), order_status, created_at)
+                  for _, order_id, name, phone, total, order_status, created_at in rows]
+        return orders, next_cursor, prev_cursor
+
     def get_web_order(self, order_id):
-        """Get specific web order"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM web_orders WHERE order_id = ?
-        ''', (order_id,))
-        
-        order = cursor.fetchone()
-        conn.close()
-        
-        return order
-    
+        """Get specific web order (amounts formatted for display)"""
+        with self.connection() as conn:
+            order = conn.execute('''
+                SELECT * FROM web_orders WHERE order_id = ?
+            ''', (order_id,)).fetchone()
+
+        if order is None:
+            return None
+        # subtotal, delivery_cost, total
+        return order[:10] + tuple(format_money(amount) for amount in order[10:13]) + order[13:]
+
+    def iter_web_orders(self, start=None, end=None, batch_size=EXPORT_BATCH_SIZE):
+        """Stream full web_orders rows with created_at in [start, end), oldest first"""
+        where, params = _created_at_range(start, end)
+        return self._iter_rows(f'''
+            SELECT order_id, customer_name, customer_phone, items, address, location_lat, location_lng,
+                   delivery_time, comment, subtotal, delivery_cost, total, status, created_at
+            FROM web_orders
+            WHERE {where}
+            ORDER BY created_at, id
+        ''', params, batch_size)
+
+    def _iter_rows(self, sql, params, batch_size):
+        """Yield the rows of a long read batch by batch from a private connection
+
+        The statement is stepped as rows are consumed, so memory stays flat
+        however large the result is, and the pool isn't held for the duration.
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
     # ============ ANALYTICS METHODS ============
-    
+
     def log_action(self, user_id, action, details=''):
-        """Log user action"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO analytics (user_id, action, details)
-            VALUES (?, ?, ?)
-        ''', (user_id, action, details))
-        
-        conn.commit()
-        conn.close()
-    
+        """Log user action (buffered, written in batches by self.analytics)"""
+        self.analytics.enqueue(user_id, action, details)
+
+    def compact_analytics(self, retention_days=ANALYTICS_RETENTION_DAYS, archive_path=ANALYTICS_ARCHIVE_PATH):
+        """Roll up, archive and delete raw analytics older than retention_days
+
+        Events before the cutoff (a UTC day boundary) are copied to monthly
+        tables analytics_YYYY_MM in the archive database file, aggregated into
+        analytics_daily (distinct users counted from the archive, so a day
+        compacted over several runs is still exact) and deleted from the
+        live table. The live file is then shrunk with incremental_vacuum
+        (switching it to auto_vacuum=INCREMENTAL with one full VACUUM the
+        first time).
+        Archive copies are keyed by id, so re-running after a crash is safe.
+        """
+        self.analytics.flush()
+        cutoff = (datetime.now(timezone.utc).date() - timedelta(days=retention_days)).isoformat()
+
+        # A private connection so the ATTACH never leaks into the pool
+        conn = self._connect()
+        try:
+            conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+
+                months = [row[0] for row in conn.execute('''
+                    SELECT DISTINCT strftime('%Y_%m', created_at)
+                    FROM analytics
+                    WHERE created_at < ?
+                ''', (cutoff,))]
+
+                archived = aggregated = 0
+                for month in months:
+                    if not re.fullmatch(r'\d{4}_\d{2}', month or ''):
+                        continue
+                    month_start = month.replace('_', '-') + '-01'
+                    conn.execute(f'''
+                        CREATE TABLE IF NOT EXISTS archive.analytics_{month} (
+                            id INTEGER PRIMARY KEY,
+                            user_id INTEGER,
+                            action TEXT NOT NULL,
+                            details TEXT,
+                            created_at TIMESTAMP
+                        )
+                    ''')
+                    conn.execute(f'''
+                        CREATE INDEX IF NOT EXISTS archive.idx_analytics_{month}_action
+                        ON analytics_{month} (action, created_at, user_id)
+                    ''')
+                    archived += conn.execute(f'''
+                        INSERT OR IGNORE INTO archive.analytics_{month} (id, user_id, action, details, created_at)
+                        SELECT id, user_id, action, details, created_at
+                        FROM analytics
+                        WHERE created_at >= ? AND created_at < DATE(?, '+1 month') AND created_at < ?
+                    ''', (month_start, month_start, cutoff)).rowcount
+
+                    # Events add up across runs, but distinct users don't: recount them over
+                    # everything archived for the day, in case earlier runs took part of it
+                    aggregated += conn.execute(f'''
+                        INSERT INTO analytics_daily (day, action, events, users)
+                        SELECT day, action, events,
+                               (SELECT COUNT(DISTINCT user_id)
+                                FROM archive.analytics_{month} AS archived
+                                WHERE archived.action = batch.action
+                                  AND archived.created_at >= batch.day
+                                  AND archived.created_at < DATE(batch.day, '+1 day'))
+                        FROM (
+                            SELECT DATE(created_at) AS day, action, COUNT(*) AS events
+                            FROM analytics
+                            WHERE created_at >= ? AND created_at < DATE(?, '+1 month') AND created_at < ?
+                            GROUP BY DATE(created_at), action
+                        ) AS batch
+                        WHERE 1
+                        ON CONFLICT (day, action) DO UPDATE SET
+                            events = events + excluded.events,
+                            users = excluded.users
+                    ''', (month_start, month_start, cutoff)).rowcount
+
+                deleted = conn.execute('DELETE FROM analytics WHERE created_at < ?', (cutoff,)).rowcount
+
+            conn.execute('DETACH DATABASE archive')
+
+            # Give the freed pages back to the filesystem
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            else:
+                conn.execute('PRAGMA incremental_vacuum')
+        finally:
+            conn.close()
+
+        logger.info("Compacted analytics before %s: %s events archived, %s deleted", cutoff, archived, deleted)
+        return {
+            'cutoff': cutoff,
+            'aggregated': aggregated,
+            'archived': archived,
+            'deleted': deleted,
+            'months': months
+        }
+
+    def iter_analytics(self, start=None, end=None, action=None, batch_size=EXPORT_BATCH_SIZE):
+        """Stream raw analytics events with created_at in [start, end), oldest first"""
+        self.analytics.flush()
+        where, params = _created_at_range(start, end)
+        if action:
+            where += ' AND action = ?'
+            params.append(action)
+        return self._iter_rows(f'''
+            SELECT id, user_id, action, details, created_at
+            FROM analytics
+            WHERE {where}
+            ORDER BY created_at, id
+        ''', params, batch_size)
+
     def get_stats(self):
         """Get statistics"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Total users
-        cursor.execute('SELECT COUNT(*) FROM users')
-        users = cursor.fetchone()[0]
-        
-        # Active products
-        cursor.execute('SELECT COUNT(*) FROM products WHERE is_active = 1')
-        products = cursor.fetchone()[0]
-        
-        # Today's catalog views
-        cursor.execute('''
-            SELECT COUNT(*) FROM analytics 
-            WHERE action = 'catalog_view' 
-            AND DATE(created_at) = DATE('now')
-        ''')
-        views = cursor.fetchone()[0]
-        
-        # Web orders today
-        cursor.execute('''
-            SELECT COUNT(*) FROM web_orders 
-            WHERE DATE(created_at) = DATE('now')
-        ''')
-        web_orders = cursor.fetchone()[0]
-        
-        # Total revenue today
-        cursor.execute('''
-            SELECT SUM(CAST(REPLACE(total, '฿', '') AS INTEGER)) 
-            FROM web_orders 
-            WHERE DATE(created_at) = DATE('now')
-        ''')
-        revenue_result = cursor.fetchone()[0]
-        revenue = revenue_result if revenue_result else 0
-        
-        conn.close()
-        
+        # Today's counters come from the daily_stats rollup, so this stays one
+        # primary-key lookup no matter how much history analytics/web_orders hold
+        with self.connection() as conn:
+            users, views, web_orders, revenue = conn.execute('''
+                SELECT (SELECT COUNT(*) FROM users),
+                       COALESCE(d.catalog_views, 0),
+                       COALESCE(d.web_orders, 0),
+                       COALESCE(d.revenue, 0)
+                FROM (SELECT DATE('now') AS day) AS today
+                LEFT JOIN daily_stats d ON d.day = today.day
+            ''').fetchone()
+
         return {
             'users': users,
-            'products': products,
+            'products': len(self.catalog().active),
             'views': views,
             'web_orders': web_orders,
-            'revenue': revenue
+            'revenue': money_amount(revenue)
         }
 
+    def backfill_daily_stats(self):
+        """Rebuild the daily_stats rollup from existing data"""
+        self.analytics.flush()
+        with self.transaction() as conn:
+            rebuild_daily_stats(conn)
+            return conn.execute('SELECT COUNT(*) FROM daily_stats').fetchone()[0]
+
+# ============ METRICS ============
+
+DB_CALL_SECONDS = metrics.histogram('spirit420_db_call_seconds', 'Database method latency in seconds', ('method',))
+DB_CALL_ERRORS = metrics.counter('spirit420_db_call_errors_total', 'Database method calls that raised', ('method',))
+
+# Context managers and row iterators return before the work is done, so timing them means nothing
+metrics.instrument_methods(Database, DB_CALL_SECONDS, DB_CALL_ERRORS,
+                           exclude=('connection', 'transaction', 'close', 'iter_web_orders', 'iter_analytics',
+                                    'add_catalog_listener'))
+
+class AsyncDatabase:
+    """Awaitable mirror of Database for asyncio code
+
+    Every Database method is available under the same name as a coroutine.
+    Calls run on a single dedicated DB thread, so the event loop never
+    blocks on SQLite and this process has exactly one writer.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.pending = 0  # calls queued or running on the DB thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            self.pending += 1
+            try:
+                return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+            finally:
+                self.pending -= 1
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+
+    def close(self):
+        """Wait for queued calls to finish and stop the DB thread"""
+        self._executor.shutdown(wait=True)
+
 # Initialize database
 db = Database()
+adb = AsyncDatabase(db)
+
+def _cache_samples(field):
+    caches = lambda: (('user', db.user_cache), ('recent_orders', db.recent_orders))
+    return lambda: [((name,), cache.stats()[field]) for name, cache in caches()]
+
+metrics.callback('spirit420_cache_hits_total', 'Cache lookups that hit', ('cache',),
+                 _cache_samples('hits'), type='counter')
+metrics.callback('spirit420_cache_misses_total', 'Cache lookups that missed', ('cache',),
+                 _cache_samples('misses'), type='counter')
+metrics.callback('spirit420_cache_hit_ratio', 'Cache hits / lookups since start', ('cache',),
+                 _cache_samples('hit_rate'))
+metrics.callback('spirit420_cache_entries', 'Entries currently cached', ('cache',),
+                 _cache_samples('size'))
+metrics.callback('spirit420_queue_depth', 'Items waiting in in-process queues', ('queue',),
+                 lambda: [(('analytics',), db.analytics.qsize()),
+                          (('db_pool_idle',), db._pool.qsize()),
+                          (('async_db_pending',), adb.pending)])
+metrics.callback('spirit420_analytics_dropped_total', 'Analytics events dropped on queue overflow', (),
+                 lambda: [((), db.analytics.dropped)], type='counter')
+metrics.callback('spirit420_catalog_version', 'Catalog version of the in-memory snapshot', (),
+                 lambda: [((), db._catalog.version if db._catalog else 0)])
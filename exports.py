@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from database import money_amount
+
+FORMATS = ('csv', 'jsonl')
+
+ORDER_FIELDS = ('orderId', 'name', 'phone', 'items', 'address', 'lat', 'lng', 'time', 'comment',
+                'subtotal', 'deliveryCost', 'total', 'status', 'createdAt')
+
+ANALYTICS_FIELDS = ('id', 'userId', 'action', 'details', 'createdAt')
+
+# Rows are written out in chunks of about this many bytes
+CHUNK_SIZE = 64 * 1024
+
+def parse_date_range(start=None, end=None):
+    """Validate from/to bounds (YYYY-MM-DD or YYYY-MM-DD HH:MM:SS) into a [start, end) pair
+
+    A date-only `end` includes that whole day.
+    """
+    def parse(value, name):
+        if not value:
+            return None
+        for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+            try:
+                return datetime.strptime(value, fmt), fmt == '%Y-%m-%d'
+            except ValueError:
+                continue
+        raise ValueError(f'{name} must be YYYY-MM-DD or YYYY-MM-DD HH:MM:SS, got {value!r}')
+
+    bounds = []
+    for value, name in ((start, 'from'), (end, 'to')):
+        parsed = parse(value, name)
+        if parsed is None:
+            bounds.append(None)
+            continue
+        moment, date_only = parsed
+        if name == 'to' and date_only:
+            moment += timedelta(days=1)
+        bounds.append(moment.strftime('%Y-%m-%d %H:%M:%S'))
+    return tuple(bounds)
+
+def order_record(row):
+    """Full web_orders export row -> dict keyed by ORDER_FIELDS (amounts in baht)"""
+    (order_id, name, phone, items, address, lat, lng, delivery_time, comment,
+     subtotal, delivery_cost, total, status, created_at) = row
+    try:
+        items = json.loads(items)
+    except (TypeError, ValueError):
+        pass
+    return dict(zip(ORDER_FIELDS, (order_id, name, phone, items, address, lat, lng, delivery_time, comment,
+                                   money_amount(subtotal), money_amount(delivery_cost), money_amount(total),
+                                   status, created_at)))
+
+def analytics_record(row):
+    return dict(zip(ANALYTICS_FIELDS, row))
+
+def iter_export(records, fields, fmt):
+    """Yield CSV or JSONL text for an iterable of dicts, CHUNK_SIZE at a time"""
+    if fmt not in FORMATS:
+        raise ValueError(f'unsupported format {fmt!r}')
+
+    out = io.StringIO()
+    writer = csv.writer(out) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(fields)
+
+    for record in records:
+        if writer:
+            writer.writerow([json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+                             for value in (record[field] for field in fields)])
+        else:
+            out.write(json.dumps(record, ensure_ascii=False, default=str))
+            out.write('\n')
+
+        if out.tell() >= CHUNK_SIZE:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+
+    if out.tell():
+        yield out.getvalue()
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_orders(database, fmt, start=None, end=None):
+    """Stream web orders in [start, end) as CSV or JSONL text chunks"""
+    rows = database.iter_web_orders(start, end)
+    return iter_export((order_record(row) for row in rows), ORDER_FIELDS, fmt)
+
+def export_analytics(database, fmt, start=None, end=None, action=None):
+    """Stream raw analytics events in [start, end) as CSV or JSONL text chunks"""
+    rows = database.iter_analytics(start, end, action=action)
+    return iter_export((analytics_record(row) for row in rows), ANALYTICS_FIELDS, fmt)
@@ -0,0 +1,104 @@
+import argparse
+import gzip
+import logging
+import sys
+
+from config import ANALYTICS_RETENTION_DAYS, ANALYTICS_ARCHIVE_PATH
+from database import db
+import catalog_io
+import exports
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+def backfill_stats(args):
+    """Rebuild the daily_stats rollup from analytics and web_orders"""
+    days = db.backfill_daily_stats()
+    print(f"daily_stats rebuilt: {days} days")
+
+def compact_analytics(args):
+    """Roll up and archive raw analytics older than the retention window"""
+    result = db.compact_analytics(retention_days=args.days, archive_path=args.archive)
+    print(f"Events before {result['cutoff']}: {result['archived']} archived "
+          f"({', '.join(result['months']) or 'no months'}), {result['deleted']} deleted")
+
+def import_catalog(args):
+    """Import products from a CSV or JSONL file (upsert by id)"""
+    fmt = args.format or catalog_io.detect_format(args.path)
+    with open(args.path, encoding='utf-8') as f:
+        report = catalog_io.import_products(db, f.read(), fmt)
+
+    print(f"Imported {report.imported} products, {len(report.errors)} errors")
+    for line, message in report.errors:
+        print(f"  line {line}: {message}")
+    if report.errors:
+        sys.exit(1)
+
+def export_catalog(args):
+    """Export all products to a CSV or JSONL file"""
+    fmt = args.format or catalog_io.detect_format(args.path)
+    with open(args.path, 'w', encoding='utf-8', newline='') as f:
+        f.write(catalog_io.export_products(db, fmt))
+    print(f"Exported catalog to {args.path}")
+
+def _write_export(path, chunks):
+    """Write streamed export chunks to a file, gzipped when it ends in .gz"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt', encoding='utf-8', newline='') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+def _export_format(args):
+    return args.format or catalog_io.detect_format(args.path.removesuffix('.gz'))
+
+def export_orders(args):
+    """Export web orders (optionally --from/--to) to a CSV or JSONL file"""
+    start, end = exports.parse_date_range(args.start, args.end)
+    _write_export(args.path, exports.export_orders(db, _export_format(args), start, end))
+    print(f"Exported orders to {args.path}")
+
+def export_analytics(args):
+    """Export raw analytics events (optionally --from/--to/--action) to a CSV or JSONL file"""
+    start, end = exports.parse_date_range(args.start, args.end)
+    _write_export(args.path, exports.export_analytics(db, _export_format(args), start, end, action=args.action))
+    print(f"Exported analytics to {args.path}")
+
+def main():
+    """Maintenance commands for spirit420.db"""
+    parser = argparse.ArgumentParser(description='spirit420 maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('backfill-stats', help=backfill_stats.__doc__).set_defaults(func=backfill_stats)
+
+    command = commands.add_parser('compact-analytics', help=compact_analytics.__doc__)
+    command.add_argument('--days', type=int, default=ANALYTICS_RETENTION_DAYS,
+                         help='keep this many days of raw events (default: %(default)s)')
+    command.add_argument('--archive', default=ANALYTICS_ARCHIVE_PATH,
+                         help='archive database file (default: %(default)s)')
+    command.set_defaults(func=compact_analytics)
+
+    for name, func in (('import-catalog', import_catalog), ('export-catalog', export_catalog)):
+        command = commands.add_parser(name, help=func.__doc__)
+        command.add_argument('path')
+        command.add_argument('--format', choices=catalog_io.FORMATS,
+                             help='file format (default: from the file extension)')
+        command.set_defaults(func=func)
+
+    for name, func in (('export-orders', export_orders), ('export-analytics', export_analytics)):
+        command = commands.add_parser(name, help=func.__doc__)
+        command.add_argument('path', help='output file; a .gz suffix gzips it')
+        command.add_argument('--format', choices=exports.FORMATS,
+                             help='file format (default: from the file extension)')
+        command.add_argument('--from', dest='start', help='first day (YYYY-MM-DD), inclusive')
+        command.add_argument('--to', dest='end', help='last day (YYYY-MM-DD), inclusive')
+        if name == 'export-analytics':
+            command.add_argument('--action', help='only events with this action')
+        command.set_defaults(func=func)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
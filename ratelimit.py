@@ -0,0 +1,132 @@
+import fcntl
+import hashlib
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+class ProcessSharedLock:
+    """Mutex across threads and forked processes that a dying process can't keep
+
+    Threads of one process take a plain lock; processes then take a POSIX
+    record lock on an unlinked temp file shared through fork. The kernel
+    drops a record lock when its process exits, so a worker killed while
+    holding it (OOM, SIGKILL) can't leave the others blocked.
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._thread_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self._file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+class TokenBuckets:
+    """Token buckets refilling `rate` tokens per second up to `capacity`, in shared memory
+
+    The state lives in anonymous shared memory guarded by a ProcessSharedLock,
+    so processes forked after construction (serve.py workers) all
+    draw from the same tokens. Keys are hashed onto `slots` buckets; a
+    bucket passes to a new key only once its previous owner has been quiet
+    long enough to refill it completely, and until then the two share it.
+    """
+
+    def __init__(self, rate, capacity, slots=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.slots = slots
+        self._owners = multiprocessing.RawArray('Q', slots)  # key hash per bucket, 0 = unused
+        self._tokens = multiprocessing.RawArray('d', slots)
+        self._updated = multiprocessing.RawArray('d', slots)
+        self._lock = ProcessSharedLock()
+
+    def _slot(self, key):
+        digest = int.from_bytes(hashlib.blake2b(str(key).encode('utf-8'), digest_size=8).digest(), 'big')
+        return digest % self.slots, digest | 1
+
+    def try_acquire(self, key=None, tokens=1):
+        """Take tokens if available; returns 0 on success, else seconds until they will be"""
+        slot, owner = self._slot(key) if self.slots > 1 else (0, 1)
+        with self._lock:
+            now = time.monotonic()
+            available = min(self.capacity, self._tokens[slot] + (now - self._updated[slot]) * self.rate)
+            if self._owners[slot] != owner and (not self._owners[slot] or available >= self.capacity):
+                # Unused, or the previous owner has gone quiet: the new key starts with a full bucket
+                self._owners[slot] = owner
+                available = self.capacity
+            self._updated[slot] = now
+            if available >= tokens:
+                self._tokens[slot] = available - tokens
+                return 0.0
+            self._tokens[slot] = available
+            return (tokens - available) / self.rate
+
+    def refund(self, key=None, tokens=1):
+        """Give back tokens taken for a request that was rejected further on"""
+        slot, _ = self._slot(key) if self.slots > 1 else (0, 1)
+        with self._lock:
+            self._tokens[slot] = min(self.capacity, self._tokens[slot] + tokens)
+
+class AdmissionController:
+    """Per-client and global token buckets plus a cap on concurrent writes
+
+    A rate of 0 disables that bucket. The buckets are in shared memory, so
+    build the controller before forking and every worker draws from the
+    same tokens. Client buckets are hashed onto `max_clients` slots. The
+    in-flight cap stays per process: a slot held by a worker that dies is
+    simply gone with it, instead of being lost to every other worker.
+    """
+
+    def __init__(self, client_rate, client_burst, global_rate, global_burst,
+                 max_in_flight, in_flight_wait=0.0, max_clients=10000):
+        self.client_buckets = TokenBuckets(client_rate, client_burst, max_clients) if client_rate > 0 else None
+        self.global_bucket = TokenBuckets(global_rate, global_burst) if global_rate > 0 else None
+        self.in_flight_wait = in_flight_wait
+        self._in_flight = threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+
+    def check_rate(self, key, tokens=1):
+        """Charge the client and global buckets; returns (None, 0) or (reason, retry_after)"""
+        if self.client_buckets:
+            wait = self.client_buckets.try_acquire(key, tokens)
+            if wait:
+                return 'client', wait
+
+        if self.global_bucket:
+            wait = self.global_bucket.try_acquire(tokens=tokens)
+            if wait:
+                if self.client_buckets:
+                    self.client_buckets.refund(key, tokens)
+                return 'global', wait
+
+        return None, 0.0
+
+    def acquire_write_slot(self):
+        """Wait briefly for one of the in-flight write slots"""
+        if self._in_flight is None:
+            return True
+        return self._in_flight.acquire(timeout=self.in_flight_wait) if self.in_flight_wait > 0 \
+            else self._in_flight.acquire(blocking=False)
+
+    def release_write_slot(self):
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+def retry_after_header(seconds):
+    """Retry-After value: whole seconds, at least 1"""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,236 @@
+import json
+import math
+
+from database import parse_money, money_amount, order_payload_hash
+
+class SchemaError(ValueError):
+    """Validation failure carrying every problem found as (field path, message)"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__('; '.join(f'{path}: {message}' for path, message in self.errors))
+
+    def to_list(self):
+        return [{'field': path, 'message': message} for path, message in self.errors]
+
+REQUIRED = object()
+_MISSING = object()
+
+# ============ FIELD DECODERS ============
+# A decoder takes (value, path) and returns the clean value or raises SchemaError.
+
+def _fail(path, message):
+    raise SchemaError([(path, message)])
+
+def text(max_length, min_length=1):
+    """String (numbers accepted and converted), stripped, with length bounds"""
+    def decode(value, path):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            _fail(path, 'must be a string')
+        value = str(value).strip()
+        if len(value) < min_length:
+            _fail(path, 'must not be empty')
+        if len(value) > max_length:
+            _fail(path, f'must be at most {max_length} characters')
+        return value
+    return decode
+
+def integer(minimum=None, maximum=None):
+    """Integer; numeric strings and whole floats are coerced"""
+    def decode(value, path):
+        if isinstance(value, bool):
+            _fail(path, 'must be an integer')
+        try:
+            number = float(value) if isinstance(value, (str, float)) else value
+            if not isinstance(number, (int, float)) or not float(number).is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError, OverflowError):
+            _fail(path, 'must be an integer')
+        if minimum is not None and number < minimum:
+            _fail(path, f'must be at least {minimum}')
+        if maximum is not None and number > maximum:
+            _fail(path, f'must be at most {maximum}')
+        return number
+    return decode
+
+def number(minimum=None, maximum=None):
+    """Finite float; numeric strings are coerced"""
+    def decode(value, path):
+        if isinstance(value, bool):
+            _fail(path, 'must be a number')
+        try:
+            result = float(value)
+        except (TypeError, ValueError):
+            _fail(path, 'must be a number')
+        if not math.isfinite(result):
+            _fail(path, 'must be a finite number')
+        if minimum is not None and result < minimum:
+            _fail(path, f'must be at least {minimum}')
+        if maximum is not None and result > maximum:
+            _fail(path, f'must be at most {maximum}')
+        return result
+    return decode
+
+def money(allow_text=False):
+    """Amount like 1200, "1200.50" or "฿1,200" -> minor units
+
+    With allow_text, a string without any amount (e.g. "Free") means 0.
+    """
+    def decode(value, path):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            _fail(path, 'must be an amount')
+        if isinstance(value, float) and not math.isfinite(value):
+            _fail(path, 'must be an amount')
+        if isinstance(value, str) and not any(char.isdigit() for char in value):
+            if allow_text:
+                return 0
+            _fail(path, 'must be an amount')
+        amount = parse_money(value)
+        if amount < 0:
+            _fail(path, 'must not be negative')
+        return amount
+    return decode
+
+def array(item_decoder, min_items=0, max_items=None):
+    """List decoded item by item; errors are reported per index"""
+    def decode(value, path):
+        if not isinstance(value, list):
+            _fail(path, 'must be an array')
+        if len(value) < min_items:
+            _fail(path, f'must have at least {min_items} item(s)')
+        if max_items is not None and len(value) > max_items:
+            _fail(path, f'must have at most {max_items} items')
+
+        result, errors = [], []
+        for index, item in enumerate(value):
+            try:
+                result.append(item_decoder(item, f'{path}[{index}]'))
+            except SchemaError as e:
+                errors.extend(e.errors)
+        if errors:
+            raise SchemaError(errors)
+        return result
+    return decode
+
+def compile_schema(spec, factory, keep_extra=False):
+    """Compile [(keys, decoder, default)] into a decoder of objects
+
+    `keys` is the field name or a tuple of accepted aliases, the first being
+    canonical. `default` is REQUIRED or the value used when the field is
+    absent or null. Decoded values are passed to `factory` positionally in
+    spec order; with keep_extra, scalar fields outside the spec are passed
+    on as a dict in a final argument.
+    """
+    fields = tuple((keys if isinstance(keys, tuple) else (keys,), decoder, default)
+                   for keys, decoder, default in spec)
+    known = frozenset(key for keys, _, _ in fields for key in keys)
+
+    def decode(data, path=''):
+        if not isinstance(data, dict):
+            _fail(path or '$', 'must be an object')
+
+        prefix = f'{path}.' if path else ''
+        values, errors = [], []
+        for keys, decoder, default in fields:
+            value = _MISSING
+            for key in keys:
+                value = data.get(key, _MISSING)
+                if value is not _MISSING:
+                    break
+            if value is _MISSING or value is None:
+                if default is REQUIRED:
+                    errors.append((prefix + keys[0], 'is required'))
+                values.append(default)
+                continue
+            try:
+                values.append(decoder(value, prefix + keys[0]))
+            except SchemaError as e:
+                errors.extend(e.errors)
+
+        if errors:
+            raise SchemaError(errors)
+        if keep_extra:
+            values.append({key: value for key, value in data.items()
+                           if key not in known and isinstance(value, (str, int, float, bool))})
+        return factory(*values)
+
+    return decode
+
+# ============ ORDERS ============
+
+class Order:
+    """A decoded website order: clean strings, float coordinates, amounts in minor units"""
+
+    __slots__ = ('order_id', 'name', 'phone', 'items', 'address', 'lat', 'lng',
+                 'time', 'comment', 'subtotal', 'delivery', 'total')
+
+    def __init__(self, order_id, name, phone, items, address, location, time, comment,
+                 subtotal, delivery, total):
+        self.order_id = order_id
+        self.name = name
+        self.phone = phone
+        self.items = items
+        self.address = address
+        self.lat, self.lng = location
+        self.time = time
+        self.comment = comment
+        self.subtotal = subtotal
+        self.delivery = delivery
+        self.total = total
+
+    def to_dict(self):
+        """Canonical website-shaped form (amounts in baht)"""
+        return {
+            'orderId': self.order_id,
+            'name': self.name,
+            'phone': self.phone,
+            'items': self.items,
+            'address': self.address,
+            'location': {'lat': self.lat, 'lng': self.lng},
+            'time': self.time,
+            'comment': self.comment,
+            'subtotal': money_amount(self.subtotal),
+            'delivery': money_amount(self.delivery),
+            'total': money_amount(self.total)
+        }
+
+    def items_json(self):
+        return json.dumps(self.items, ensure_ascii=False, separators=(',', ':'))
+
+    def payload_hash(self):
+        """Fingerprint of the normalized order, so formatting differences aren't conflicts"""
+        return order_payload_hash(self.to_dict())
+
+def _order_item(product_id, name, quantity, price, extra):
+    item = {**extra, 'name': name, 'quantity': quantity, 'price': money_amount(price)}
+    if product_id is not None:
+        item['id'] = product_id
+    return item
+
+decode_order_item = compile_schema([
+    ('id', integer(minimum=1), None),
+    ('name', text(200), REQUIRED),
+    (('quantity', 'qty'), integer(minimum=1, maximum=1000), 1),
+    ('price', money(allow_text=True), 0),
+], _order_item, keep_extra=True)
+
+decode_location = compile_schema([
+    ('lat', number(-90, 90), REQUIRED),
+    ('lng', number(-180, 180), REQUIRED),
+], lambda lat, lng: (lat, lng))
+
+# Validates and decodes a website order dict into an Order (raises SchemaError)
+decode_order = compile_schema([
+    ('orderId', text(64), REQUIRED),
+    ('name', text(200), REQUIRED),
+    ('phone', text(50), REQUIRED),
+    ('items', array(decode_order_item, min_items=1, max_items=100), REQUIRED),
+    ('address', text(500), REQUIRED),
+    ('location', decode_location, REQUIRED),
+    ('time', text(100), REQUIRED),
+    ('comment', text(1000, min_length=0), ''),
+    ('subtotal', money(allow_text=True), 0),
+    ('delivery', money(allow_text=True), 0),
+    ('total', money(), REQUIRED),
+], Order)
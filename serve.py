@@ -0,0 +1,253 @@
+# Production server for the API (stdlib + Werkzeug, which ships with Flask).
+#
+#   python serve.py            # or: web: python serve.py in the Procfile
+#
+# The master process binds PORT once and pre-forks WEB_WORKERS workers that
+# all accept on that socket. Each worker gives every connection a thread and
+# runs at most WEB_THREADS requests at once (event streams aside), and
+# opens its own SQLite connections after the fork. Werkzeug answers every
+# request with Connection: close, so each connection carries one request.
+#
+# Signals to the master:
+#   SIGTERM / SIGINT  graceful shutdown: workers stop accepting, finish
+#                     in-flight requests (up to WEB_GRACEFUL_TIMEOUT) and exit
+#   SIGHUP            graceful reload: start a fresh set of workers, then
+#                     gracefully stop the old ones
+# Workers that die are restarted automatically.
+#
+# Behind a router or proxy (e.g. a PaaS, as with the Procfile), set
+# TRUSTED_PROXY_HOPS so order rate limits key on the real client address
+# from X-Forwarded-For rather than the proxy's.
+#
+# Metrics are per process, so every sample a worker exports carries a
+# worker="<pid>" label. /metrics on PORT reaches whichever worker accepts
+# the connection; to scrape each worker on every pass, set WEB_METRICS_PORT
+# and worker slot N also serves its own /metrics on WEB_METRICS_PORT + N.
+
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+from config import WEB_WORKERS, WEB_THREADS, WEB_GRACEFUL_TIMEOUT, WEB_METRICS_PORT
+import metrics
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger('serve')
+
+# Server-Sent Events endpoints: connections stay open for as long as the client listens
+STREAM_PATHS = ('/api/products/stream',)
+
+# Clients that send nothing for this long (e.g. a stalled request) are disconnected
+SOCKET_TIMEOUT = 30
+
+class SlottedRequestHandler(WSGIRequestHandler):
+    """Runs each request under one of the server's request slots"""
+    timeout = SOCKET_TIMEOUT
+
+    def run_wsgi(self):
+        # Long-lived event streams mostly sleep, so they don't take a request slot
+        if self.path.startswith(STREAM_PATHS):
+            return super().run_wsgi()
+        with self.server.request_slots:
+            return super().run_wsgi()
+
+class SlottedWSGIServer(ThreadedWSGIServer):
+    """Thread per connection, but at most `threads` requests running the app at once"""
+
+    def __init__(self, app, fd, threads):
+        super().__init__('0.0.0.0', 0, app, handler=SlottedRequestHandler, fd=fd)
+        self.threads = threads
+        self.request_slots = threading.BoundedSemaphore(threads)
+
+    def drain(self, timeout):
+        """Wait for in-flight requests (by taking every slot), then close this worker's socket"""
+        deadline = time.monotonic() + timeout
+        for _ in range(self.threads):
+            if not self.request_slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+                logger.warning("Worker %s stopping with requests still running", os.getpid())
+                break
+        self.server_close()
+
+class WorkerMetricsServer:
+    """This worker's /metrics on its own port; binds in the background while the
+    port is still held by the worker it replaces (during a reload or restart)"""
+
+    def __init__(self, port):
+        self.port = port
+        self.server = None
+        self.stopped = threading.Event()
+        threading.Thread(target=self._bind, name='metrics-bind', daemon=True).start()
+
+    def _bind(self):
+        while not self.stopped.is_set():
+            try:
+                self.server = metrics.start_http_server(self.port)
+                logger.info("Worker %s metrics on port %s", os.getpid(), self.port)
+                return
+            except OSError:
+                self.stopped.wait(1)
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+def run_worker(listener, threads, slot):
+    """Worker process body: serve until SIGTERM, then drain and exit"""
+    from api import app, catalog_feed
+    from database import db
+
+    metrics.REGISTRY.set_const_labels(worker=os.getpid())
+    metrics_server = WorkerMetricsServer(WEB_METRICS_PORT + slot) if WEB_METRICS_PORT else None
+    server = SlottedWSGIServer(app, listener.fileno(), threads)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so call it off this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+        if metrics_server:
+            # Hand the metrics port over to the replacement worker right away
+            threading.Thread(target=metrics_server.close, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master decides when we stop
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    logger.info("Worker %s serving with %s threads", os.getpid(), threads)
+    try:
+        server.serve_forever()
+    finally:
+        catalog_feed.close()
+        if metrics_server:
+            metrics_server.close()
+        server.drain(WEB_GRACEFUL_TIMEOUT)
+        db.close()
+    logger.info("Worker %s stopped", os.getpid())
+
+class Master:
+    """Pre-fork master: owns the listening socket and supervises workers"""
+
+    def __init__(self, port, workers=WEB_WORKERS, threads=WEB_THREADS):
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.generation = 0
+        self.children = {}  # pid -> (generation, slot)
+        self.stopping = False
+        self.reload_requested = False
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('0.0.0.0', port))
+        self.listener.listen(1024)
+
+        # Import the app before forking so workers share its pages copy-on-write
+        # and the shared-memory order admission limits
+        import api  # noqa: F401
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.listener, self.threads, slot)
+            except Exception:
+                logger.exception("Worker crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = (self.generation, slot)
+
+    def spawn_generation(self):
+        self.generation += 1
+        for slot in range(self.workers):
+            self.spawn(slot)
+
+    def signal_workers(self, signum, generation=None):
+        for pid, (worker_generation, _) in list(self.children.items()):
+            if generation is None or worker_generation == generation:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def reap(self):
+        """Collect exited workers; restart the ones from the current generation"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+
+            generation, slot = self.children.pop(pid, (None, None))
+            if generation == self.generation and not self.stopping:
+                logger.warning("Worker %s exited (status %s), restarting", pid, status)
+                self.spawn(slot)
+
+    def reload(self):
+        """Graceful reload: new workers first, then drain the old generation"""
+        old_generation = self.generation
+        self.spawn_generation()
+        self.signal_workers(signal.SIGTERM, generation=old_generation)
+        logger.info("Reloaded workers (generation %s)", self.generation)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+
+        logger.info("Master %s listening on port %s, %s workers x %s threads",
+                    os.getpid(), self.port, self.workers, self.threads)
+        self.spawn_generation()
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap()
+            time.sleep(0.5)
+
+        self.shutdown()
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def shutdown(self):
+        logger.info("Stopping %s workers", len(self.children))
+        self.signal_workers(signal.SIGTERM)
+
+        deadline = time.monotonic() + WEB_GRACEFUL_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        if self.children:
+            logger.warning("Killing %s workers that did not stop in time", len(self.children))
+            self.signal_workers(signal.SIGKILL)
+            self.reap()
+
+        self.listener.close()
+
+def main():
+    """Run the API with pre-forked, threaded workers"""
+    port = int(os.environ.get('PORT', 5000))
+    Master(port).run()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
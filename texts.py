@@ -42,6 +42,7 @@ TEXTS = {
         'select_sort_type': '🌱 Выберите тип сорта:',
         'catalog_disclaimer': 'Ниже представлен ассортимент магазина исключительно для ознакомления.\n\nНаличие и условия уточняются лично в магазине.',
         'no_products': 'В этой категории пока нет товаров',
+        'page_of': 'Страница {page} из {pages}',
         
         # Product Card
         'product_card': '''🌿 {name}
@@ -111,6 +112,12 @@ TEXTS = {
         'product_added': '✅ Товар успешно добавлен на сайт!',
         'product_updated': '✅ Товар успешно обновлен!',
         
+        # Catalog Import/Export
+        'catalog_imported': '📦 Импорт каталога завершен\n\n✅ Загружено товаров: {imported}\n❌ Ошибок: {errors}',
+        'catalog_import_unsupported': '❌ Поддерживаются только файлы .csv и .jsonl',
+        'catalog_import_bad_encoding': '❌ Файл не в кодировке UTF-8. Сохраните его как «CSV UTF-8» и загрузите снова',
+        'catalog_exported': '📦 Экспорт каталога',
+        
         # Stats
         'stats': '''📊 Статистика
 
@@ -174,6 +181,7 @@ We're happy to help! ✨''',
         'select_sort_type': '🌱 Select sort type:',
         'catalog_disclaimer': 'The following product list is provided for reference only.\n\nAvailability and conditions are confirmed in person at the store.',
         'no_products': 'No products in this category yet',
+        'page_of': 'Page {page} of {pages}',
         
         # Product Card
         'product_card': '''🌿 {name}
@@ -243,6 +251,12 @@ Choose an action:''',
         'product_added': '✅ Product added to website successfully!',
         'product_updated': '✅ Product updated successfully!',
         
+        # Catalog Import/Export
+        'catalog_imported': '📦 Catalog import finished\n\n✅ Products loaded: {imported}\n❌ Errors: {errors}',
+        'catalog_import_unsupported': '❌ Only .csv and .jsonl files are supported',
+        'catalog_import_bad_encoding': '❌ The file is not UTF-8 encoded. Save it as "CSV UTF-8" and upload it again',
+        'catalog_exported': '📦 Catalog export',
+        
         # Stats
         'stats': '''📊 Statistics
 
@@ -306,6 +320,7 @@ Choose an action:''',
         'select_sort_type': '🌱 เลือกประเภทสายพันธุ์:',
         'catalog_disclaimer': 'รายการสินค้าด้านล่างจัดทำขึ้นเพื่อการอ้างอิงเท่านั้น\n\nสินค้าและเงื่อนไขสามารถตรวจสอบได้ที่ร้านโดยตรง',
         'no_products': 'ยังไม่มีสินค้าในหมวดหมู่นี้',
+        'page_of': 'หน้า {page} จาก {pages}',
         
         # Product Card
         'product_card': '''🌿 {name}
@@ -375,6 +390,12 @@ Choose an action:''',
         'product_added': '✅ เพิ่มสินค้าลงเว็บไซต์สำเร็จ!',
         'product_updated': '✅ อัปเดตสินค้าสำเร็จ!',
         
+        # Catalog Import/Export
+        'catalog_imported': '📦 นำเข้าแคตตาล็อกเสร็จสิ้น\n\n✅ โหลดสินค้าแล้ว: {imported}\n❌ ข้อผิดพลาด: {errors}',
+        'catalog_import_unsupported': '❌ รองรับเฉพาะไฟล์ .csv และ .jsonl',
+        'catalog_import_bad_encoding': '❌ ไฟล์ไม่ได้เข้ารหัสเป็น UTF-8 โปรดบันทึกเป็น "CSV UTF-8" แล้วอัปโหลดอีกครั้ง',
+        'catalog_exported': '📦 ส่งออกแคตตาล็อก',
+        
         # Stats
         'stats': '''📊 สถิติ
 